@@ -0,0 +1,67 @@
+"""Run the benchmark once per BROWSER_PROFILE and compare Chrome's cost.
+
+    python bench/compare_profiles.py --rate 5 --duration 60
+
+Every argument is passed through to run.py. Each profile runs in its own
+process (main reads its config at import), with the same seed and load.
+The fake page loads no WhatsApp assets, so this measures the flags and
+viewport; the effect of request blocking shows up on a live bot via
+zoha_chrome_rss_bytes / zoha_chrome_cpu_seconds on /metrics.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILES = ("full", "lean")
+ROWS = (
+    ("chrome_rss_mb", "chrome rss (MB)"),
+    ("chrome_cpu_seconds", "chrome cpu (s)"),
+    ("messages_per_second", "messages/second"),
+    ("latency_p50", "latency p50 (s)"),
+    ("latency_p99", "latency p99 (s)"),
+    ("dropped", "dropped"),
+)
+
+
+def run_profile(profile: str, args) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        path = f.name
+    try:
+        subprocess.run(
+            [
+                sys.executable,
+                os.path.join(BENCH_DIR, "run.py"),
+                *args,
+                "--browser-profile",
+                profile,
+                "--max-dropped",
+                "1000000",
+                "--json",
+                path,
+            ],
+            check=True,
+        )
+        with open(path) as f:
+            return json.load(f)
+    finally:
+        os.unlink(path)
+
+
+def main():
+    args = sys.argv[1:]
+    reports = {profile: run_profile(profile, args) for profile in PROFILES}
+
+    print()
+    print(f"{'':20}" + "".join(f"{profile:>12}" for profile in PROFILES) + f"{'change':>12}")
+    for key, label in ROWS:
+        full, lean = (reports[profile][key] for profile in PROFILES)
+        change = f"{(lean - full) / full * 100:+.0f}%" if full else "-"
+        print(f"{label:20}{full:>12}{lean:>12}{change:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Offline end-to-end benchmark: ZohaAIBot against a fake WhatsApp Web.
+
+Serves fake_whatsapp.html on localhost, swaps Gemini for StubModel, lets the
+page inject messages at a fixed rate and reports throughput, reply latency
+and dropped messages. No phone, network or Gemini key needed, only Chromium
+and chromedriver (CHROME_BIN / CHROMEDRIVER_PATH as for the bot itself).
+
+    python bench/run.py --rate 5 --duration 60 --chats 20 --ai-latency 0.8
+
+Other bot settings (OUTBOUND_RATE, AI_CONCURRENCY, AI_STREAM, ...) are
+taken from the environment as usual. Exits non-zero when more than
+--max-dropped messages went unanswered.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+from aiohttp import web
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from stub_ai import StubModel  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=2.0, help="messages/second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument(
+        "--mode",
+        choices=["command", "chat"],
+        default="command",
+        help="'.gemini' commands or plain private-chat messages",
+    )
+    parser.add_argument("--ingest", choices=["observer", "poll"], default="observer")
+    parser.add_argument("--browser-profile", choices=["lean", "full"], default="full")
+    parser.add_argument("--ai-latency", type=float, default=0.5)
+    parser.add_argument("--ai-jitter", type=float, default=0.2)
+    parser.add_argument("--ai-error-rate", type=float, default=0.0)
+    parser.add_argument("--answer-chars", type=int, default=200)
+    parser.add_argument("--ack-ms", type=int, default=50, help="delivery tick delay")
+    parser.add_argument("--grace", type=float, default=30, help="max wait for stragglers")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-dropped", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile, 0 for no samples"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+async def serve_page(port: int) -> web.AppRunner:
+    async def page(request):
+        return web.FileResponse(os.path.join(BENCH_DIR, "fake_whatsapp.html"))
+
+    server = web.Application()
+    server.router.add_get("/", page)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def results(bot) -> dict:
+    return await bot.drive(
+        bot.driver.execute_script, "return window.__benchResults();", op="execute_script"
+    )
+
+
+async def run(args) -> dict:
+    # main reads its config at import time, so point it at the fake page
+    # and keep all state files out of the working tree
+    state_dir = tempfile.mkdtemp(prefix="zoha-bench-")
+    port = free_port()
+    page_options = {"chats": args.chats, "ack": args.ack_ms}
+    os.environ.update(
+        {
+            "WHATSAPP_URL": f"http://127.0.0.1:{port}/?{urlencode(page_options)}",
+            "GEMINI_API_KEY": "",
+            "HEADLESS": "true",
+            "INGEST_MODE": args.ingest,
+            "BROWSER_PROFILE": args.browser_profile,
+            "CHECKPOINT_FILE": os.path.join(state_dir, "checkpoint.jsonl"),
+            "AI_CACHE_FILE": os.path.join(state_dir, "ai_cache.json"),
+            "CONVO_DB": os.path.join(state_dir, "conversations.db"),
+            "CHROME_PROFILE_DIR": os.path.join(state_dir, "chrome-profile"),
+            "SESSION_ARCHIVE": "",
+            "MEDIA_DIR": os.path.join(state_dir, "media"),
+            "IMAGE_CACHE_DIR": os.path.join(state_dir, "image-cache"),
+            "BROADCAST_FILE": os.path.join(state_dir, "broadcasts.json"),
+        }
+    )
+    import main
+
+    bot = main.bot
+    bot.gemini_client = StubModel(
+        latency=args.ai_latency,
+        jitter=args.ai_jitter,
+        answer_chars=args.answer_chars,
+        error_rate=args.ai_error_rate,
+        seed=args.seed,
+    )
+    bot.ai = main.AIBackend(
+        bot.gemini_client,
+        concurrency=bot.config["AI_CONCURRENCY"],
+        timeout=bot.config["AI_TIMEOUT"],
+        retries=bot.config["AI_RETRIES"],
+    )
+
+    runner = await serve_page(port)
+    monitor = None
+    try:
+        bot.setup_stores()
+        await bot.setup_browser()
+        await bot.drive(bot.driver.get, bot.config["WHATSAPP_URL"], op="get")
+        if not await bot.check_connection():
+            raise RuntimeError("fake WhatsApp page did not load")
+
+        monitor = asyncio.create_task(bot.monitor_messages())
+        while not bot.resumed:
+            await asyncio.sleep(0.1)
+        # Let the first tick install the observer and seed fingerprints
+        await asyncio.sleep(2)
+
+        total = await bot.drive(
+            bot.driver.execute_script,
+            "return window.__benchStart(arguments[0]);",
+            {"rate": args.rate, "duration": args.duration, "mode": args.mode, "seed": args.seed},
+            op="execute_script",
+        )
+        print(f"🏁 Injecting {total} messages into {args.chats} chats at {args.rate}/s")
+        _, cpu_before = bot.browser_usage()
+        await asyncio.sleep(args.duration)
+
+        # Wait for stragglers until every message is answered or grace runs out
+        deadline = time.monotonic() + args.grace
+        state = await results(bot)
+        while (state["running"] or state["missing"]) and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+            state = await results(bot)
+
+        rss, cpu_after = bot.browser_usage()
+        report = build_report(args, state, bot, rss, cpu_after - cpu_before)
+    finally:
+        if monitor:
+            monitor.cancel()
+            await asyncio.gather(monitor, return_exceptions=True)
+        await bot.cleanup()
+        await runner.cleanup()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    return report
+
+
+def build_report(args, state: dict, bot, rss: int, cpu: float) -> dict:
+    latencies = [ms / 1000 for ms in state["latencies"]]
+    elapsed = state["elapsed"] / 1000
+    return {
+        "config": {
+            "rate": args.rate,
+            "duration": args.duration,
+            "chats": args.chats,
+            "mode": args.mode,
+            "ingest": args.ingest,
+            "browser_profile": args.browser_profile,
+            "ai_latency": args.ai_latency,
+            "ai_error_rate": args.ai_error_rate,
+        },
+        "injected": state["injected"],
+        "replied": len(latencies),
+        "dropped": len(state["missing"]),
+        "duplicates": state["duplicates"],
+        "messages_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 3),
+        "latency_p99": round(percentile(latencies, 99), 3),
+        "latency_max": round(max(latencies, default=0.0), 3),
+        "outgoing_messages": state["outgoing"],
+        "observer_dropped": state["observerDropped"],
+        "ack_timeouts": bot.ack_timeouts,
+        "ai": bot.ai.stats(),
+        "outbound": bot.outbound.stats(),
+        "driver": bot.actor.stats(),
+        "chrome_rss_mb": round(rss / 1024 / 1024, 1),
+        "chrome_cpu_seconds": round(cpu, 2),
+    }
+
+
+def print_report(report: dict):
+    print()
+    print("📊 Benchmark results")
+    print(f"   injected          {report['injected']}")
+    print(f"   replied           {report['replied']}")
+    print(f"   dropped           {report['dropped']}")
+    print(f"   duplicates        {report['duplicates']}")
+    print(f"   messages/second   {report['messages_per_second']}")
+    print(f"   latency p50       {report['latency_p50']}s")
+    print(f"   latency p99       {report['latency_p99']}s")
+    print(f"   latency max       {report['latency_max']}s")
+    print(f"   outgoing messages {report['outgoing_messages']}")
+    print(f"   ack timeouts      {report['ack_timeouts']}")
+    print(f"   chrome rss        {report['chrome_rss_mb']} MB")
+    print(f"   chrome cpu        {report['chrome_cpu_seconds']}s")
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["dropped"] > args.max_dropped else 0)
+
+
+if __name__ == "__main__":
+    main()
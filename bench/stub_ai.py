@@ -0,0 +1,82 @@
+"""Stand-in for the Gemini model used by the benchmark.
+
+Implements the two calls AIBackend makes, generate_content_async(prompt)
+and generate_content_async(prompt, stream=True), with configurable latency,
+jitter, answer length and transient error rate. The answer echoes the last
+line of the prompt so the fake page can match replies to the messages that
+caused them.
+"""
+
+import asyncio
+import random
+
+from google.api_core import exceptions as google_exceptions
+
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubStream:
+    """Async iterable of response chunks, like a streamed Gemini response"""
+
+    def __init__(self, pieces, delay: float):
+        self.pieces = pieces
+        self.delay = delay
+
+    async def __aiter__(self):
+        for piece in self.pieces:
+            await asyncio.sleep(self.delay)
+            yield StubResponse(piece)
+
+
+class StubModel:
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.2,
+        answer_chars: int = 200,
+        error_rate: float = 0.0,
+        stream_chunks: int = 4,
+        seed: int = 1,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.answer_chars = answer_chars
+        self.error_rate = error_rate
+        self.stream_chunks = max(1, stream_chunks)
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    def _answer(self, prompt: str) -> str:
+        question = prompt.strip().splitlines()[-1] if prompt.strip() else ""
+        answer = f"Stub answer to: {question}."
+        filler = " Lorem ipsum dolor sit amet, consectetur adipiscing elit."
+        while len(answer) < self.answer_chars:
+            answer += filler
+        return answer
+
+    async def _think(self, share: float = 1.0):
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        await asyncio.sleep(max(0.0, delay * share))
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        self.calls += 1
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            await self._think(0.5)
+            raise google_exceptions.ServiceUnavailable("stub overloaded")
+
+        answer = self._answer(prompt)
+        if not stream:
+            await self._think()
+            return StubResponse(answer)
+
+        # Time to first token is half the latency, the rest is spread
+        # across the chunks
+        await self._think(0.5)
+        size = -(-len(answer) // self.stream_chunks)
+        pieces = [answer[i : i + size] for i in range(0, len(answer), size)]
+        return StubStream(pieces, self.latency * 0.5 / len(pieces))
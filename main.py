@@ -4,25 +4,31 @@ import json
 import time
 import asyncio
 import logging
-import pickle
+import hashlib
+import math
+import sqlite3
 import base64
-from selenium.webdriver.chrome.service import Service
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
-from typing import Optional, Dict, List
-from quart import Quart, request, jsonify, render_template_string
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.keys import Keys
-import google.generativeai as genai
-import qrcode
+from functools import wraps
+from typing import Optional, Dict, List, Tuple
+from quart import Quart, request, jsonify, render_template_string, send_file
+import importlib
 import io
-import aiohttp
+import mimetypes
 import random
+import re
 import shutil
+import signal
+import tarfile
+import tempfile
+import queue
+import threading
+import concurrent.futures
+import contextvars
+import contextlib
+import hmac
+from xml.sax.saxutils import escape
 
 # Setup logging
 logging.basicConfig(
@@ -32,33 +38,3091 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class LazyImport:
+    """Stand-in for a module (or one of its attributes) imported on first use.
+
+    Selenium, the Gemini SDK and aiohttp together take over a second to
+    import; deferring them lets the web server come up first and lets
+    startup import them off the event loop with resolve().
+    """
+
+    def __init__(self, module: str, attr: Optional[str] = None):
+        self.__dict__["_spec"] = (module, attr)
+        self.__dict__["_target"] = None
+
+    def resolve(self):
+        target = self.__dict__["_target"]
+        if target is None:
+            module, attr = self.__dict__["_spec"]
+            target = importlib.import_module(module)
+            if attr:
+                target = getattr(target, attr)
+            self.__dict__["_target"] = target
+        return target
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+
+webdriver = LazyImport("selenium.webdriver")
+Service = LazyImport("selenium.webdriver.chrome.service", "Service")
+Options = LazyImport("selenium.webdriver.chrome.options", "Options")
+By = LazyImport("selenium.webdriver.common.by", "By")
+Keys = LazyImport("selenium.webdriver.common.keys", "Keys")
+ActionChains = LazyImport("selenium.webdriver.common.action_chains", "ActionChains")
+WebDriverWait = LazyImport("selenium.webdriver.support.ui", "WebDriverWait")
+EC = LazyImport("selenium.webdriver.support.expected_conditions")
+genai = LazyImport("google.generativeai")
+google_exceptions = LazyImport("google.api_core.exceptions")
+aiohttp = LazyImport("aiohttp")
+Image = LazyImport("PIL.Image")
+ImageOps = LazyImport("PIL.ImageOps")
+
 app = Quart(__name__)
 
+# Process start, for real uptime (the bot object is rebuilt on /restart)
+STARTED_AT = time.time()
+
+
+def process_started_at() -> float:
+    """When the interpreter was launched (Linux), for cold-start timing"""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            # starttime is field 22, counted in clock ticks since boot
+            ticks = int(f.read().rsplit(b")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            booted = time.time() - float(f.read().split()[0])
+        return booted + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return STARTED_AT
+
+
+PROCESS_STARTED_AT = process_started_at()
+
+
+class Metrics:
+    """Minimal thread-safe registry rendered in Prometheus text format.
+
+    Supports labelled counters and histograms plus gauges whose value is
+    read from a callback at scrape time.
+    """
+
+    DEFAULT_BUCKETS = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def describe(self, name: str, kind: str, help_text: str, buckets=None):
+        self.meta[name] = (kind, help_text, tuple(buckets or self.DEFAULT_BUCKETS))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.meta[name][2]
+        with self.lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = {
+                    "buckets": [0] * len(buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def gauge(self, name: str, help_text: str, fn):
+        self.describe(name, "gauge", help_text)
+        self.gauges[name] = fn
+
+    @staticmethod
+    def _labels(labels, extra=()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        body = ",".join(
+            '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+            for k, v in pairs
+        )
+        return "{" + body + "}"
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: dict(data, buckets=list(data["buckets"]))
+                for key, data in self.histograms.items()
+            }
+
+        for name, (kind, help_text, buckets) in sorted(self.meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            if kind == "gauge" and name in self.gauges:
+                try:
+                    lines.append(f"{name} {float(self.gauges[name]())}")
+                except Exception:
+                    pass
+            elif kind == "counter":
+                for (series, labels), value in sorted(counters.items()):
+                    if series == name:
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+            elif kind == "histogram":
+                for (series, labels), data in sorted(histograms.items()):
+                    if series != name:
+                        continue
+                    for bound, count in zip(buckets, data["buckets"]):
+                        lines.append(
+                            f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}"
+                        )
+                    lines.append(
+                        f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {data['count']}"
+                    )
+                    lines.append(f"{name}_sum{self._labels(labels)} {data['sum']}")
+                    lines.append(f"{name}_count{self._labels(labels)} {data['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe(
+    "zoha_monitor_tick_seconds", "histogram", "Duration of one monitor tick"
+)
+metrics.describe(
+    "zoha_monitor_chats_scanned",
+    "histogram",
+    "Chats inspected per monitor tick",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250),
+)
+metrics.describe(
+    "zoha_messages_ingested_total", "counter", "Incoming messages handed to handlers"
+)
+metrics.describe(
+    "zoha_selenium_call_seconds", "histogram", "WebDriver call latency by operation"
+)
+metrics.describe("zoha_ai_request_seconds", "histogram", "Gemini request latency")
+metrics.describe("zoha_ai_errors_total", "counter", "Failed Gemini requests by error")
+metrics.describe(
+    "zoha_reply_latency_seconds",
+    "histogram",
+    "Time from ingesting a message to delivering its first reply",
+)
+metrics.describe("zoha_outbound_sent_total", "counter", "Outbound sends by kind")
+metrics.describe(
+    "zoha_broadcast_sends_total", "counter", "Broadcast send attempts by result"
+)
+
+# Set while a message is being handled so the outbound queue can attribute
+# the first reply it delivers to the message that caused it, and collect the
+# reply futures the message waits on before it is checkpointed as done
+REPLY_ORIGIN = contextvars.ContextVar("reply_origin", default=None)
+
+
+def process_tree_usage(root_pid: int) -> Tuple[int, float]:
+    """Resident memory (bytes) and CPU time (seconds) of root_pid and all
+    its descendants (Linux)"""
+    children = {}
+    cpu = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                # Fields after the parenthesised command name: ppid is the
+                # second, utime and stime the 12th and 13th
+                fields = f.read().rsplit(b")", 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+            cpu[int(entry)] = int(fields[11]) + int(fields[12])
+        except (OSError, ValueError, IndexError):
+            continue
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    rss = 0
+    ticks = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                rss += int(f.read().split()[1]) * page_size
+        except (OSError, ValueError, IndexError):
+            pass
+        ticks += cpu.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return rss, ticks / os.sysconf("SC_CLK_TCK")
+
+
+def process_tree(root_pid: int) -> List[int]:
+    """root_pid and all its descendants (Linux)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                ppid = int(f.read().rsplit(b")", 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+
+    tree = []
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def kill_processes(pids: List[int], timeout: float = 10) -> bool:
+    """SIGKILL pids and wait until none is running; False on timeout"""
+    for pid in pids:
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.kill(pid, signal.SIGKILL)
+
+    def running(pid):
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                # Zombies have exited, they only wait to be reaped
+                return f.read().rsplit(b")", 1)[1].split()[0] != b"Z"
+        except (OSError, IndexError):
+            return False
+
+    deadline = time.monotonic() + timeout
+    while True:
+        pids = [pid for pid in pids if running(pid)]
+        if not pids:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.1)
+
+
+def frame_label(code) -> str:
+    """Stack frame name for profiles: qualified function name and file"""
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)})"
+
+
+def task_label(task) -> str:
+    """Name of the coroutine an asyncio task is running"""
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or task.get_name()
+
+
+def await_chain(coro) -> List[str]:
+    """Where a suspended coroutine is waiting, outermost call first"""
+    chain = []
+    while coro is not None and len(chain) < 64:
+        frame = (
+            getattr(coro, "cr_frame", None)
+            or getattr(coro, "gi_frame", None)
+            or getattr(coro, "ag_frame", None)
+        )
+        if frame is None:
+            # A future, or a coroutine that already finished
+            if not hasattr(coro, "cr_code"):
+                kind = coro.__class__.__name__
+                chain.append(f"awaiting {'Future' if kind == 'FutureIter' else kind}")
+            break
+        chain.append(f"{frame_label(frame.f_code)}:{frame.f_lineno}")
+        coro = (
+            getattr(coro, "cr_await", None)
+            or getattr(coro, "gi_yieldfrom", None)
+            or getattr(coro, "ag_await", None)
+        )
+    return chain
+
+
+def dump_tasks() -> List[Dict]:
+    """Every asyncio task with its await chain (call from the event loop)"""
+    current = asyncio.current_task()
+    return sorted(
+        (
+            {
+                "name": task.get_name(),
+                "coro": task_label(task),
+                "current": task is current,
+                "stack": await_chain(task.get_coro()),
+            }
+            for task in asyncio.all_tasks()
+        ),
+        key=lambda entry: entry["coro"],
+    )
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler for the whole process.
+
+    A daemon thread snapshots sys._current_frames() at a fixed interval and
+    counts collapsed stacks ("thread;outer;...;inner"). Event loop samples
+    are rooted at the asyncio task that was running, so the profile shows
+    which coroutine is holding the loop.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stacks = Counter()
+        self.holders = Counter()
+        self.samples = 0
+        self.interval = 0.01
+        self.thread = None
+        self.stopping = threading.Event()
+        self.loop = None
+        self.loop_thread = None
+        self.started_at = None
+        self.stopped_at = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval: float = 0.01, duration: float = 60) -> bool:
+        """Start sampling (call from the event loop); False if already running"""
+        if self.running:
+            return False
+
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        with self.lock:
+            self.stacks.clear()
+            self.holders.clear()
+            self.samples = 0
+        self.interval = interval
+        self.stopping.clear()
+        self.started_at = time.time()
+        self.stopped_at = None
+        self.thread = threading.Thread(
+            target=self._run, args=(duration,), name="zoha-profiler", daemon=True
+        )
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def _run(self, duration: float):
+        deadline = time.monotonic() + duration
+        while not self.stopping.wait(self.interval):
+            if time.monotonic() >= deadline:
+                break
+            self._sample()
+        self.stopped_at = time.time()
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        collapsed = []
+        holder = None
+
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None and len(stack) < 128:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+
+            if ident == self.loop_thread:
+                try:
+                    task = asyncio.current_task(self.loop)
+                except RuntimeError:
+                    task = None
+                holder = f"task:{task_label(task)}" if task else "(no task)"
+                stack.append(holder)
+            stack.append(names.get(ident, f"thread-{ident}"))
+            collapsed.append(";".join(reversed(stack)))
+
+        with self.lock:
+            self.samples += 1
+            self.stacks.update(collapsed)
+            if holder:
+                self.holders[holder] += 1
+
+    def collapsed(self) -> str:
+        """Folded stacks, one "frame;frame;frame count" line each"""
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def flamegraph(self, width: int = 1200, row: int = 16) -> str:
+        """Render the folded stacks as a standalone SVG flamegraph"""
+        with self.lock:
+            stacks = dict(self.stacks)
+
+        root = {"count": 0, "children": {}}
+        for stack, count in stacks.items():
+            node = root
+            node["count"] += count
+            for name in stack.split(";"):
+                node = node["children"].setdefault(
+                    name, {"count": 0, "children": {}}
+                )
+                node["count"] += count
+
+        total = root["count"] or 1
+        boxes = []
+        pending = [(root, "all", 0.0, 0)]
+        while pending:
+            node, name, x, depth = pending.pop()
+            box_width = width * node["count"] / total
+            if box_width < 0.3:
+                continue
+            boxes.append((name, node["count"], x, depth, box_width))
+            offset = x
+            for child_name, child in sorted(node["children"].items()):
+                pending.append((child, child_name, offset, depth + 1))
+                offset += width * child["count"] / total
+
+        height = (max((box[3] for box in boxes), default=0) + 1) * row
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+            f'height="{height}" font-family="monospace" font-size="11">'
+        ]
+        for name, count, x, depth, box_width in boxes:
+            hue = int(hashlib.md5(name.encode()).hexdigest()[:2], 16) % 40
+            y = height - (depth + 1) * row
+            label = escape(name[: int(box_width / 7)]) if box_width > 30 else ""
+            parts.append(
+                f'<g><title>{escape(name)} ({count} samples, '
+                f"{100 * count / total:.1f}%)</title>"
+                f'<rect x="{x:.1f}" y="{y}" width="{box_width:.1f}" '
+                f'height="{row - 1}" fill="hsl({hue}, 90%, 60%)"/>'
+                f'<text x="{x + 3:.1f}" y="{y + row - 4}">{label}</text></g>'
+            )
+        parts.append("</svg>")
+        return "\n".join(parts)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            holders = dict(self.holders.most_common(10))
+            samples = self.samples
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running,
+            "samples": samples,
+            "interval": self.interval,
+            "seconds": round(end - self.started_at, 1) if self.started_at else 0,
+            "loop_holders": holders,
+        }
+
+
+# Process-wide, like metrics: profiling survives /restart of the bot
+profiler = SamplingProfiler()
+
+
+# Reads one chat-list row into a plain object; shared by the observer and scan
+CHAT_ROW_JS = """
+const ROW = 'div[data-testid="cell-frame-container"]';
+const readRow = (row) => {
+    const title = row.querySelector('div[data-testid="cell-frame-title"] span[title]');
+    const status = row.querySelector('div[data-testid="last-msg-status"]');
+    const text = status && (status.querySelector('span[title]') || status);
+    const time = row.querySelector('div[data-testid="cell-frame-primary-detail"]');
+    const badge = row.querySelector('span[data-testid="icon-unread-count"]');
+    const icon = status && status.querySelector('span[data-icon]');
+    const iconName = icon ? icon.getAttribute('data-icon') : '';
+    return {
+        title: title ? title.getAttribute('title') : '',
+        preview: text ? (text.getAttribute('title') || text.textContent || '') : '',
+        time: time ? time.textContent : '',
+        unread: badge ? (parseInt(badge.textContent, 10) || 1) : 0,
+        mentioned: !!row.querySelector('span[data-icon="mention"]'),
+        outgoing: /^status-(check|dblcheck|time)/.test(iconName),
+        media: /^status-(image|video|gif|ptt|audio|document|sticker)/.test(iconName),
+        at: Date.now(),
+    };
+};
+"""
+
+# Chat-list observer injected into WhatsApp Web. Each chat row is fingerprinted
+# by its last-message preview and time; when that changes or the unread count
+# grows (a repeat message in the same minute keeps the fingerprint) an event
+# is pushed onto window.__zohaQueue, which the monitor drains in one
+# execute_script call.
+OBSERVER_JS = CHAT_ROW_JS + """
+if (window.__zohaObserver && document.contains(window.__zohaPane)) {
+    return true;
+}
+if (window.__zohaObserver) {
+    window.__zohaObserver.disconnect();
+}
+const pane = document.querySelector('div[data-testid="chat-list"]');
+if (!pane) {
+    return false;
+}
+
+const MAX_QUEUE = 500;
+const seen = new Map();
+
+const scan = (row) => {
+    const state = readRow(row);
+    if (!state.title) {
+        return;
+    }
+    const print = state.preview + '|' + state.time;
+    const previous = seen.get(state.title);
+    seen.set(state.title, { print: print, unread: state.unread });
+    // First sighting only seeds the fingerprint, history is never replayed
+    if (!previous) {
+        return;
+    }
+    const grown = state.unread - previous.unread;
+    if (previous.print === print && grown <= 0) {
+        return;
+    }
+    // Messages behind this event (the preview only shows the newest)
+    state.fresh = Math.max(1, grown);
+    if (window.__zohaQueue.length >= MAX_QUEUE) {
+        window.__zohaQueue.shift();
+        window.__zohaDropped += 1;
+    }
+    window.__zohaQueue.push(state);
+};
+
+window.__zohaQueue = [];
+window.__zohaDropped = 0;
+pane.querySelectorAll(ROW).forEach(scan);
+
+const observer = new MutationObserver((mutations) => {
+    const rows = new Set();
+    for (const m of mutations) {
+        const node = m.target.nodeType === 1 ? m.target : m.target.parentElement;
+        const row = node && node.closest(ROW);
+        if (row) {
+            rows.add(row);
+        }
+        m.addedNodes.forEach((added) => {
+            if (added.nodeType === 1) {
+                added.querySelectorAll(ROW).forEach((r) => rows.add(r));
+            }
+        });
+    }
+    rows.forEach(scan);
+});
+observer.observe(pane, { childList: true, subtree: true, characterData: true });
+window.__zohaObserver = observer;
+window.__zohaPane = pane;
+return true;
+"""
+
+# Every rendered chat row (unread count, preview, flags) in one round trip
+SCAN_CHATS_JS = CHAT_ROW_JS + """
+return Array.from(document.querySelectorAll(ROW)).map(readRow);
+"""
+
+# Open chat's title as the chat list spells it: the span[title] attribute,
+# else the text with emoji images put back from their data-plain-text
+HEADER_JS = """
+const readHeader = () => {
+    const header = document.querySelector('div[data-testid="conversation-info-header-chat-title"]');
+    if (!header) {
+        return null;
+    }
+    const titled = header.querySelector('span[title]');
+    if (titled && titled.getAttribute('title')) {
+        return titled.getAttribute('title');
+    }
+    const text = (node) => node.nodeType === Node.TEXT_NODE
+        ? node.textContent
+        : node.nodeName === 'IMG'
+            ? (node.getAttribute('data-plain-text') || node.getAttribute('alt') || '')
+            : Array.from(node.childNodes).map(text).join('');
+    return text(header).trim();
+};
+"""
+
+# Open chat's title plus its messages as compact JSON, oldest first. Messages
+# after id arguments[0] are returned if it is still rendered, otherwise the
+# newest arguments[1]. Author and time come from WhatsApp's
+# data-pre-plain-text attribute ("[10:30, 17/10/2026] Name: ").
+EXTRACT_MESSAGES_JS = HEADER_JS + """
+const title = readHeader();
+if (title === null) {
+    return null;
+}
+const since = arguments[0];
+const limit = arguments[1] || 50;
+
+const containers = Array.from(document.querySelectorAll('div[data-testid="msg-container"]'));
+const messages = containers.map((el) => {
+    const holder = el.closest('[data-id]');
+    const pre = el.querySelector('[data-pre-plain-text]');
+    const meta = el.querySelector('div[data-testid="msg-meta"]');
+    const text = el.querySelector('span.selectable-text');
+    const match = pre ? /^\\[(.*?)\\]\\s*(.*?):\\s*$/.exec(pre.getAttribute('data-pre-plain-text')) : null;
+    const outgoing = !!(el.closest('div.message-out') || el.querySelector('div.message-out'));
+
+    let media = null;
+    if (el.querySelector('video')) {
+        media = 'video';
+    } else if (el.querySelector('audio, span[data-icon="audio-play"], span[data-icon="ptt-play"]')) {
+        media = 'audio';
+    } else if (el.querySelector('span[data-icon="document"], span[data-icon^="document-"]')) {
+        media = 'document';
+    } else if (el.querySelector('img:not([data-plain-text]), div[data-testid="media-url-provider"]')) {
+        media = 'image';
+    }
+
+    const time = match ? match[1] : (meta ? meta.textContent : '');
+    const body = text ? text.textContent.trim() : '';
+    return {
+        id: holder ? holder.getAttribute('data-id') : time + '|' + body,
+        direction: outgoing ? 'out' : 'in',
+        author: match ? match[2] : '',
+        time: time,
+        text: body,
+        media: media,
+    };
+});
+
+let start = Math.max(0, messages.length - limit);
+if (since) {
+    const index = messages.findIndex((m) => m.id === since);
+    if (index >= 0) {
+        start = index + 1;
+    }
+}
+return { chat: title, messages: messages.slice(start) };
+"""
+
+# Returns buffered events and empties the queue, or null if the observer is gone
+DRAIN_JS = """
+if (!window.__zohaObserver || !document.contains(window.__zohaPane)) {
+    return null;
+}
+return window.__zohaQueue.splice(0);
+"""
+
+# Outgoing message count in the open chat, taken just before sending
+OUTGOING_COUNT_JS = "return document.querySelectorAll('div.message-out').length;"
+
+# True once a new outgoing message (beyond arguments[0]) shows a delivery tick
+ACK_JS = """
+const outgoing = document.querySelectorAll('div.message-out');
+if (outgoing.length <= arguments[0]) {
+    return false;
+}
+const last = outgoing[outgoing.length - 1];
+return !!last.querySelector(
+    'span[data-icon="msg-check"], span[data-icon="msg-dblcheck"], span[data-icon="msg-dblcheck-ack"]'
+);
+"""
+
+# Clears the compose box (arguments[0]) and inserts arguments[1] in one go.
+# arguments[2] picks the method: "paste" dispatches a synthetic clipboard
+# paste (keeps newlines without sending), "insertText" uses execCommand,
+# "clear"/"check" only clear or report. Returns whether the box has text.
+INSERT_TEXT_JS = """
+const box = arguments[0];
+const text = arguments[1];
+const mode = arguments[2];
+box.focus();
+if (mode !== 'check') {
+    document.execCommand('selectAll', false, null);
+    document.execCommand('delete', false, null);
+}
+if (mode === 'paste') {
+    const data = new DataTransfer();
+    data.setData('text/plain', text);
+    box.dispatchEvent(new ClipboardEvent('paste', {
+        clipboardData: data, bubbles: true, cancelable: true,
+    }));
+} else if (mode === 'insertText') {
+    document.execCommand('insertText', false, text);
+}
+return box.textContent.trim().length > 0;
+"""
+
+# Finds the chat-list row whose title matches arguments[0]
+OPEN_CHAT_JS = """
+const rows = document.querySelectorAll('div[data-testid="cell-frame-container"]');
+for (const row of rows) {
+    const title = row.querySelector('div[data-testid="cell-frame-title"] span[title]');
+    if (title && title.getAttribute('title') === arguments[0]) {
+        return row;
+    }
+}
+return null;
+"""
+
+# Search result row for phone number arguments[0]: a row titled with that
+# number (unsaved contact), else the top chat/contact hit. Rows whose snippet
+# contains the digits are message hits and are skipped.
+SEARCH_NUMBER_JS = """
+const digits = arguments[0];
+const only = (text) => (text || '').replace(/\\D/g, '');
+const rows = Array.from(document.querySelectorAll('div[data-testid="cell-frame-container"]'));
+const titled = rows.find((row) => {
+    const title = row.querySelector('div[data-testid="cell-frame-title"] span[title]');
+    return title && only(title.getAttribute('title')).endsWith(digits);
+});
+if (titled) {
+    return titled;
+}
+const top = rows[0];
+if (!top || !top.querySelector('div[data-testid="cell-frame-title"] span[title]')) {
+    return null;
+}
+const snippet = top.querySelector('div[data-testid="cell-frame-secondary"]');
+return snippet && only(snippet.textContent).includes(digits) ? null : top;
+"""
+
+# Starts a background job that waits up to arguments[1] ms for the media of
+# message arguments[0] to finish downloading, fetches its blob: URL in the
+# page and parks the bytes in window.__zohaBlobs. Returns the job id at once,
+# or null when that message isn't rendered; poll the job with MEDIA_POLL_JS.
+MEDIA_FETCH_JS = """
+const msgId = arguments[0];
+const timeoutMs = arguments[1];
+const maxBytes = arguments[2];
+const row = () => (msgId ? document.querySelector('[data-id="' + CSS.escape(msgId) + '"]') : null);
+// Kept in case another chat is opened while the job runs
+const first = row();
+if (!first) {
+    return null;
+}
+const job = 'j' + Date.now() + Math.random().toString(36).slice(2);
+window.__zohaJobs = window.__zohaJobs || {};
+window.__zohaJobs[job] = { pending: true };
+const done = (result) => {
+    window.__zohaJobs[job] = { pending: false, result: result };
+};
+const selector = 'video[src^="blob:"], img[src^="blob:"]';
+
+const find = () => {
+    const holder = row() || first;
+    const media = holder.querySelector(selector);
+    return media ? media.src : null;
+};
+
+const started = Date.now();
+const attempt = () => {
+    const src = find();
+    if (!src) {
+        if (Date.now() - started < timeoutMs) {
+            setTimeout(attempt, 250);
+        } else {
+            done(null);
+        }
+        return;
+    }
+    fetch(src)
+        .then((response) => response.blob())
+        .then(async (blob) => {
+            if (blob.size > maxBytes) {
+                done({ error: 'too large', size: blob.size });
+                return;
+            }
+            const token = 'b' + Date.now() + Math.random().toString(36).slice(2);
+            window.__zohaBlobs = window.__zohaBlobs || {};
+            window.__zohaBlobs[token] = new Uint8Array(await blob.arrayBuffer());
+            done({ token: token, size: blob.size, type: blob.type });
+        })
+        .catch((e) => done({ error: String(e) }));
+};
+attempt();
+return job;
+"""
+
+# State of MEDIA_FETCH_JS job arguments[0]: {pending: true} while running,
+# then {pending: false, result} once, where result is {token, size, type},
+# {error} or null. The job is forgotten after it is reported.
+MEDIA_POLL_JS = """
+const jobs = window.__zohaJobs || {};
+const state = jobs[arguments[0]];
+if (!state) {
+    return { pending: false, result: { error: 'job lost' } };
+}
+if (!state.pending) {
+    delete jobs[arguments[0]];
+}
+return state;
+"""
+
+# Base64 of bytes [arguments[1], arguments[1] + arguments[2]) of a parked
+# blob; a length of 0 releases it. null once the blob is gone.
+MEDIA_CHUNK_JS = """
+const blobs = window.__zohaBlobs || {};
+const data = blobs[arguments[0]];
+if (!data) {
+    return null;
+}
+if (!arguments[2]) {
+    delete blobs[arguments[0]];
+    return '';
+}
+const chunk = data.subarray(arguments[1], arguments[1] + arguments[2]);
+let binary = '';
+for (let i = 0; i < chunk.length; i += 0x8000) {
+    binary += String.fromCharCode.apply(null, chunk.subarray(i, i + 0x8000));
+}
+return btoa(binary);
+"""
+
+# Title of the open conversation, or null when no chat is open
+HEADER_TITLE_JS = HEADER_JS + """
+return readHeader();
+"""
+
+# Chat-list search box; its results reuse the chat-list row markup
+SEARCH_BOX_SELECTORS = (
+    'div[data-testid="chat-list-search"][contenteditable="true"]',
+    'div[contenteditable="true"][data-tab="3"]',
+)
+
+# BROWSER_PROFILE=lean: Chrome switches that trim background work and memory
+LEAN_CHROME_FLAGS = (
+    "--disable-extensions",
+    "--disable-component-update",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+    "--disable-smooth-scrolling",
+    "--force-prefers-reduced-motion",
+    # Headless tabs count as hidden; throttled timers delay WhatsApp's
+    # socket handling and our observer
+    "--disable-background-timer-throttling",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-renderer-backgrounding",
+    # One site only, so per-site renderer processes buy nothing here
+    "--disable-features=Translate,MediaRouter,OptimizationHints,"
+    "IsolateOrigins,site-per-process",
+    "--renderer-process-limit=2",
+)
+
+# Requests a lean browser never makes: avatars, fonts, GIF providers and
+# telemetry. CDP Network.setBlockedURLs patterns.
+LEAN_BLOCKED_URLS = [
+    "*://pps.whatsapp.net/*",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*://*.giphy.com/*",
+    "*://*.tenor.com/*",
+    "*://crashlogs.whatsapp.net/*",
+    "*://dit.whatsapp.net/*",
+]
+
+# Media downloads (uploads go to /mms/ and stay allowed); lifted while
+# media_unblocked() is active
+MEDIA_BLOCKED_URLS = [
+    "*://mmg.whatsapp.net/v/*",
+    "*://mmg.whatsapp.net/d/*",
+    "*://media*.cdn.whatsapp.net/*",
+]
+
+# Injected before any page script: no CSS animations or transitions
+NO_ANIMATION_JS = """
+document.addEventListener('DOMContentLoaded', () => {
+    const style = document.createElement('style');
+    style.textContent = '*, *::before, *::after { animation: none !important; transition: none !important; }';
+    document.head.appendChild(style);
+});
+"""
+
+
+class DriverActor:
+    """Owns all WebDriver access on a single dedicated thread.
+
+    Selenium calls are blocking HTTP round trips to chromedriver. Running them
+    on the asyncio loop stalls every Quart route, so callers submit commands
+    to this thread's queue and await the result through a future instead.
+    """
+
+    def __init__(self, name: str = "selenium-driver"):
+        self.commands = queue.Queue()
+        self.stopped = False
+        self.current_op = None
+        self.op_started = 0.0
+
+        # Metrics
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.max_depth = 0
+        self.busy_seconds = 0.0
+
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            command = self.commands.get()
+            if command is None:
+                break
+
+            future, op, fn, args = command
+            # Skip commands whose caller already gave up waiting
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self.current_op = op
+            started = self.op_started = time.monotonic()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                elapsed = time.monotonic() - started
+                self.busy_seconds += elapsed
+                self.current_op = None
+                metrics.observe("zoha_selenium_call_seconds", elapsed, op=op)
+
+    async def call(self, fn, *args, op: Optional[str] = None, timeout: float = 30):
+        """Run fn(*args) on the driver thread and await its result"""
+        if self.stopped:
+            raise RuntimeError("Driver actor is stopped")
+
+        future = concurrent.futures.Future()
+        self.commands.put((future, op or fn.__name__, fn, args))
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self.commands.qsize())
+
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # A queued command is dropped; a running one finishes unobserved
+            self.timed_out += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+
+        self.completed += 1
+        return result
+
+    async def stop(self, timeout: float = 10):
+        """Finish queued commands and stop the driver thread"""
+        if self.stopped:
+            return
+        self.stopped = True
+        self.commands.put(None)
+        await asyncio.to_thread(self.thread.join, timeout)
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self.commands.qsize(),
+            "max_queue_depth": self.max_depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "current_op": self.current_op,
+        }
+
+
+class AIBackend:
+    """Async front end for the Gemini model.
+
+    Requests run concurrently under a semaphore, each bounded by a deadline
+    and retried with jittered exponential backoff on transient errors.
+    In-flight calls are tracked so shutdown can cancel them cleanly.
+    """
+
+    def __init__(
+        self,
+        model,
+        concurrency: int = 4,
+        timeout: float = 30,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        self.model = model
+        self.transient_errors = (
+            asyncio.TimeoutError,
+            ConnectionError,
+            google_exceptions.TooManyRequests,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+        )
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.tasks = set()
+        self.closed = False
+
+        # Metrics
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+
+    async def generate(self, prompt: str) -> str:
+        """Generate a reply, raising on failure or when the deadline passes"""
+        if self.closed:
+            raise RuntimeError("AI backend is shut down")
+
+        self.requests += 1
+        task = asyncio.ensure_future(self._generate(prompt))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        started = time.monotonic()
+        try:
+            return await task
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            metrics.inc("zoha_ai_errors_total", error=e.__class__.__name__)
+            raise
+        finally:
+            metrics.observe("zoha_ai_request_seconds", time.monotonic() - started)
+
+    async def _generate(self, prompt: str) -> str:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        attempt = 0
+
+        while True:
+            try:
+                async with self.semaphore:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    return await asyncio.wait_for(self._request(prompt), remaining)
+
+            except self.transient_errors as e:
+                attempt += 1
+                await self._backoff(e, attempt, deadline)
+
+    async def _backoff(self, error: Exception, attempt: int, deadline: float):
+        """Sleep before retry `attempt`, or re-raise if retries or time ran out"""
+        loop = asyncio.get_running_loop()
+        delay = random.uniform(0.5, 1.0) * self.backoff * 2 ** (attempt - 1)
+        if attempt > self.retries or loop.time() + delay >= deadline:
+            raise error
+
+        self.retried += 1
+        logger.warning(
+            f"⚠️ AI transient error ({error.__class__.__name__}), "
+            f"retry {attempt}/{self.retries} in {delay:.1f}s"
+        )
+        await asyncio.sleep(delay)
+
+    async def _request(self, prompt: str) -> str:
+        if hasattr(self.model, "generate_content_async"):
+            response = await self.model.generate_content_async(prompt)
+        else:
+            response = await asyncio.to_thread(self.model.generate_content, prompt)
+        return response.text
+
+    async def stream(self, prompt: str):
+        """Yield reply text as the model generates it.
+
+        Generation runs in a tracked producer task (so close() can cancel
+        it) that hands pieces over through a queue.
+        """
+        if self.closed:
+            raise RuntimeError("AI backend is shut down")
+
+        self.requests += 1
+        pieces = asyncio.Queue()
+        task = asyncio.ensure_future(self._stream(prompt, pieces))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        started = time.monotonic()
+        try:
+            while True:
+                piece = await pieces.get()
+                if piece is None:
+                    return
+                if isinstance(piece, BaseException):
+                    self.failures += 1
+                    if isinstance(piece, Exception):
+                        metrics.inc(
+                            "zoha_ai_errors_total", error=piece.__class__.__name__
+                        )
+                    raise piece
+                yield piece
+        finally:
+            task.cancel()
+            metrics.observe("zoha_ai_request_seconds", time.monotonic() - started)
+
+    async def _stream(self, prompt: str, pieces: asyncio.Queue):
+        try:
+            if not hasattr(self.model, "generate_content_async"):
+                pieces.put_nowait(await self._generate(prompt))
+                pieces.put_nowait(None)
+                return
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            attempt = 0
+            started = False
+
+            while True:
+                try:
+                    async with self.semaphore:
+                        response = await asyncio.wait_for(
+                            self.model.generate_content_async(prompt, stream=True),
+                            max(deadline - loop.time(), 0),
+                        )
+                        chunks = response.__aiter__()
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(
+                                    chunks.__anext__(), max(deadline - loop.time(), 0)
+                                )
+                            except StopAsyncIteration:
+                                break
+                            if chunk.text:
+                                started = True
+                                pieces.put_nowait(chunk.text)
+                    pieces.put_nowait(None)
+                    return
+
+                except self.transient_errors as e:
+                    # Once text went out a retry would repeat it
+                    if started:
+                        raise
+                    attempt += 1
+                    await self._backoff(e, attempt, deadline)
+
+        except BaseException as e:
+            pieces.put_nowait(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+
+    async def close(self):
+        """Cancel in-flight requests and refuse new ones"""
+        self.closed = True
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self.tasks),
+            "requests": self.requests,
+            "retries": self.retried,
+            "failures": self.failures,
+        }
+
+
+class ResponseCache:
+    """TTL + LRU cache of AI replies keyed by normalized prompt.
+
+    Expiry uses wall-clock time so entries stay valid when the cache is
+    persisted to disk and reloaded after a restart.
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 3600, path: str = ""):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def make_key(command: str, prompt: str) -> str:
+        """Fold case, punctuation and whitespace so rephrasings share a key"""
+        text = re.sub(r"[^\w\s]", "", prompt.casefold())
+        return f"{command}:{' '.join(text.split())}"
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: str):
+        self.entries[key] = (time.time() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def load(self):
+        """Restore unexpired entries from the cache file"""
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+            now = time.time()
+            for key, (expires, value) in data.items():
+                if expires > now:
+                    self.entries[key] = (expires, value)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            logger.info(f"💾 Loaded {len(self.entries)} cached AI replies")
+        except Exception as e:
+            logger.warning(f"⚠️ AI cache load failed: {e}")
+
+    def save(self):
+        """Atomically write the cache file"""
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"⚠️ AI cache save failed: {e}")
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one in-flight call.
+
+    The first caller starts the work; later callers with the same key await
+    the same future. The shared call is shielded so one waiter giving up
+    does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn):
+        future = self.calls.get(key)
+        if future is None:
+            self.leaders += 1
+            future = asyncio.ensure_future(fn())
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self._finish(key, f))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(future)
+
+    def _finish(self, key: str, future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        # Mark the exception retrieved in case every waiter was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self.calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst` saved"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is ready now)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class OutboundQueue:
+    """Per-chat outbound scheduler.
+
+    The browser can only type into one chat at a time, so a single worker
+    drains per-chat queues round robin, except that replies go before
+    low-priority sends (broadcasts) and the chat already open in the
+    browser (`is_open`) goes first so pending sends are grouped by chat.
+    Consecutive short texts to the same chat are merged into one
+    message, each chat is rate limited by a token bucket, and `deliver`
+    returns once WhatsApp acknowledges the send, so pacing follows the page
+    instead of fixed sleeps.
+    """
+
+    MAX_BUCKETS = 1000
+    # Batches in a row the open chat may take before the others get a turn
+    MAX_STREAK = 5
+
+    def __init__(
+        self,
+        deliver,
+        rate: float = 1.0,
+        burst: float = 5,
+        coalesce_chars: int = 300,
+        max_message_chars: int = 4000,
+        is_open=None,
+    ):
+        self.deliver = deliver
+        self.is_open = is_open
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_chars = coalesce_chars
+        self.max_message_chars = max_message_chars
+
+        self.queues = OrderedDict()
+        self.buckets = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.worker = None
+        self.last_chat = None
+        self.streak = 0
+
+        # Metrics
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.grouped = 0
+
+    def put(
+        self, chat_name: str, kind: str, payload: str, low: bool = False
+    ) -> asyncio.Future:
+        """Queue a "text" or "image" send; the future resolves to True on success"""
+        if self.worker is None:
+            self.worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        origin = REPLY_ORIGIN.get()
+        if origin:
+            origin["futures"].append(future)
+        self.queues.setdefault(chat_name, deque()).append(
+            {
+                "kind": kind,
+                "payload": payload,
+                "future": future,
+                "origin": origin,
+                "low": low,
+            }
+        )
+        self.wakeup.set()
+        return future
+
+    def depth(self, low: Optional[bool] = None) -> int:
+        return sum(
+            1
+            for items in self.queues.values()
+            for item in items
+            if low is None or item["low"] == low
+        )
+
+    def _bucket(self, chat_name: str) -> TokenBucket:
+        bucket = self.buckets.get(chat_name)
+        if bucket is None:
+            bucket = self.buckets[chat_name] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+        self.buckets.move_to_end(chat_name)
+        return bucket
+
+    def _next_batch(self):
+        """Pick the next ready chat, open one first; returns (chat, items, wait)"""
+        prefer_open = self.is_open and self.streak < self.MAX_STREAK
+        # Stable sort: replies before broadcasts, then the open chat; the
+        # rest keep their round robin turn
+        order = sorted(
+            self.queues,
+            key=lambda chat_name: (
+                self.queues[chat_name][0]["low"],
+                bool(prefer_open) and not self.is_open(chat_name),
+            ),
+        )
+
+        wait = None
+        for chat_name in order:
+            bucket = self._bucket(chat_name)
+            delay = bucket.delay()
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            items = self.queues[chat_name]
+            batch = [items.popleft()]
+            if batch[0]["kind"] == "text":
+                size = len(batch[0]["payload"])
+                while (
+                    items
+                    and items[0]["kind"] == "text"
+                    and items[0]["low"] == batch[0]["low"]
+                    and len(batch[-1]["payload"]) <= self.coalesce_chars
+                    and len(items[0]["payload"]) <= self.coalesce_chars
+                    and size + len(items[0]["payload"]) + 2 <= self.max_message_chars
+                ):
+                    size += len(items[0]["payload"]) + 2
+                    batch.append(items.popleft())
+
+            if items:
+                self.queues.move_to_end(chat_name)
+            else:
+                del self.queues[chat_name]
+
+            bucket.take()
+            if self.is_open and self.is_open(chat_name):
+                self.grouped += 1
+            self.streak = self.streak + 1 if chat_name == self.last_chat else 1
+            self.last_chat = chat_name
+            return chat_name, batch, 0
+
+        return None, None, wait
+
+    async def _run(self):
+        while True:
+            if not self.queues:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            chat_name, batch, wait = self._next_batch()
+            if batch is None:
+                # Every pending chat is rate limited; sleep until one frees up
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            kind = batch[0]["kind"]
+            payload = "\n\n".join(item["payload"] for item in batch)
+            self.coalesced += len(batch) - 1
+
+            try:
+                await self.deliver(chat_name, kind, payload)
+                self.sent += 1
+                ok = True
+                metrics.inc("zoha_outbound_sent_total", kind=kind)
+                for item in batch:
+                    origin = item["origin"]
+                    if origin and not origin["replied"]:
+                        origin["replied"] = True
+                        metrics.observe(
+                            "zoha_reply_latency_seconds",
+                            time.monotonic() - origin["started"],
+                        )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Outbound {kind} to {chat_name} failed: {e}")
+                self.failed += 1
+                ok = False
+
+            for item in batch:
+                if not item["future"].done():
+                    item["future"].set_result(ok)
+
+    async def close(self):
+        """Stop the worker and resolve anything still queued as failed"""
+        if self.worker:
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+            self.worker = None
+
+        for items in self.queues.values():
+            for item in items:
+                if not item["future"].done():
+                    item["future"].set_result(False)
+        self.queues.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "depth": self.depth(),
+            "low_priority": self.depth(low=True),
+            "chats_pending": len(self.queues),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "grouped": self.grouped,
+            "failed": self.failed,
+        }
+
+
+class Broadcaster:
+    """Fans one text or image out to many chats through the outbound queue.
+
+    Sends are pipelined: up to `window` of a job's sends sit on the
+    outbound queue at once, on its low-priority lane so replies to incoming
+    messages overtake a running broadcast (urgent jobs use the normal
+    lane). Recipients that need no navigation
+    go first and phone numbers not yet resolved to a chat last. A failed
+    send is retried up to `retries` times, and a job gives up on whatever is
+    left after `max_seconds`. Jobs are kept in a JSON file and unfinished
+    ones resume after a restart, so a recipient may get a send twice if the
+    process died while it was in flight.
+    """
+
+    KEEP_JOBS = 50
+
+    def __init__(
+        self,
+        bot,
+        path: str = "",
+        window: int = 8,
+        retries: int = 2,
+        max_seconds: float = 1800,
+    ):
+        self.bot = bot
+        self.path = path
+        self.window = max(1, window)
+        self.retries = retries
+        self.max_seconds = max_seconds
+        self.jobs = OrderedDict()
+        self.runners = {}
+        self.last_save = 0.0
+
+    def create(
+        self,
+        recipients: List[str],
+        kind: str,
+        payload: str,
+        origin: str = "api",
+        urgent: bool = False,
+        notify: Optional[str] = None,
+    ) -> Dict:
+        """Record a job and start sending; returns the job record.
+
+        notify is a chat that gets a summary when the job ends.
+        """
+        if kind not in ("text", "image"):
+            raise ValueError(f"unknown kind {kind!r}")
+        targets = list(dict.fromkeys(r.strip() for r in recipients if r.strip()))
+        if not targets or not payload:
+            raise ValueError("recipients and payload are required")
+
+        job = {
+            "id": os.urandom(4).hex(),
+            "kind": kind,
+            "payload": payload,
+            "origin": origin,
+            "urgent": urgent,
+            "notify": notify,
+            "state": "running",
+            "created_at": time.time(),
+            "finished_at": None,
+            "recipients": {
+                target: {"state": "pending", "attempts": 0, "error": None}
+                for target in targets
+            },
+        }
+        self.jobs[job["id"]] = job
+        while len(self.jobs) > self.KEEP_JOBS:
+            oldest = next(
+                (job_id for job_id, old in self.jobs.items() if old["state"] != "running"),
+                None,
+            )
+            if oldest is None:
+                break
+            del self.jobs[oldest]
+        self.save()
+        self._start(job)
+        return job
+
+    def resume(self):
+        """Restart jobs left running by the previous process"""
+        for job in self.jobs.values():
+            if job["state"] == "running" and job["id"] not in self.runners:
+                logger.info(f"♻️ Resuming broadcast {job['id']}")
+                self._start(job)
+
+    def cancel(self, job_id: str) -> bool:
+        """Stop a job; sends already handed to the outbound queue still go out"""
+        job = self.jobs.get(job_id)
+        if not job or job["state"] != "running":
+            return False
+        job["state"] = "cancelled"
+        runner = self.runners.pop(job_id, None)
+        if runner:
+            runner.cancel()
+        self._finish(job, "cancelled")
+        return True
+
+    def _start(self, job: Dict):
+        self.runners[job["id"]] = self.bot.dispatch(self._run(job))
+
+    def _order(self, targets: List[str]) -> List[str]:
+        """Open chat first, then chats reachable by title, unresolved numbers last"""
+
+        def cost(target):
+            if self.bot.is_open(target):
+                return 0
+            if target in self.bot.chat_titles or not phone_digits(target):
+                return 1
+            return 2
+
+        return sorted(targets, key=cost)
+
+    async def _run(self, job: Dict):
+        # Sends belong to the job, not to a message being handled
+        REPLY_ORIGIN.set(None)
+        deadline = job["created_at"] + self.max_seconds
+        window = asyncio.Semaphore(self.window)
+
+        async def send(target: str, state: Dict):
+            async with window:
+                while state["state"] == "pending":
+                    # Hold off while pairing or during a browser handover
+                    while not self.bot.is_connected and time.time() < deadline:
+                        await asyncio.sleep(1)
+                    if time.time() >= deadline:
+                        state.update(state="failed", error="deadline")
+                        break
+
+                    state["attempts"] += 1
+                    ok = await self.bot.outbound.put(
+                        target, job["kind"], job["payload"], low=not job["urgent"]
+                    )
+                    if ok:
+                        state.update(state="sent", error=None)
+                    elif state["attempts"] > self.retries:
+                        state.update(state="failed", error="send failed")
+                    else:
+                        state["error"] = "send failed, retrying"
+                    metrics.inc(
+                        "zoha_broadcast_sends_total",
+                        result=state["state"] if state["state"] != "pending" else "retry",
+                    )
+                    if state["state"] == "pending":
+                        await asyncio.sleep(min(2 ** state["attempts"], 30))
+            self.save(force=False)
+
+        targets = self._order(
+            [t for t, state in job["recipients"].items() if state["state"] == "pending"]
+        )
+        await asyncio.gather(*(send(t, job["recipients"][t]) for t in targets))
+        self.runners.pop(job["id"], None)
+        self._finish(job, "done")
+
+    def _finish(self, job: Dict, state: str):
+        for recipient in job["recipients"].values():
+            if recipient["state"] == "pending":
+                recipient["state"] = state
+        job["state"] = state
+        job["finished_at"] = time.time()
+        self.save()
+        counts = self.summary(job)
+        summary = (
+            f"📣 Broadcast {job['id']} {state}: {counts.get('sent', 0)} sent, "
+            f"{counts.get('failed', 0)} failed"
+        )
+        logger.info(summary)
+        if job.get("notify"):
+            self.bot.outbound.put(job["notify"], "text", summary)
+
+    @staticmethod
+    def summary(job: Dict) -> Dict:
+        return dict(Counter(r["state"] for r in job["recipients"].values()))
+
+    def view(self, job: Dict, recipients: bool = True) -> Dict:
+        """Job record for the API, payload shortened"""
+        view = {
+            key: value
+            for key, value in job.items()
+            if key != "recipients" or recipients
+        }
+        view["payload"] = job["payload"][:200]
+        view["progress"] = self.summary(job)
+        return view
+
+    def load(self):
+        """Read the job file, if any (called at startup, not import)"""
+        try:
+            if not self.path or not os.path.exists(self.path):
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                for job in json.load(f):
+                    self.jobs[job["id"]] = job
+            logger.info(f"💾 Loaded {len(self.jobs)} broadcast jobs")
+        except Exception as e:
+            logger.warning(f"⚠️ Broadcast jobs load failed: {e}")
+
+    def save(self, force: bool = True):
+        """Atomically write the job file, at most once a second unless forced"""
+        if not self.path or (not force and time.monotonic() - self.last_save < 1):
+            return
+        self.last_save = time.monotonic()
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self.jobs.values()), f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"⚠️ Broadcast jobs save failed: {e}")
+
+    def stats(self) -> Dict:
+        states = Counter(job["state"] for job in self.jobs.values())
+        return {
+            "jobs": len(self.jobs),
+            "running": states.get("running", 0),
+            "recipients_pending": sum(
+                self.summary(job).get("pending", 0)
+                for job in self.jobs.values()
+                if job["state"] == "running"
+            ),
+        }
+
+
+def format_uptime() -> str:
+    """Human readable time since process start, e.g. "2d 3h 4m" """
+    minutes, _ = divmod(int(time.time() - STARTED_AT), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h {minutes}m"
+
+
+def chat_key(chat_name: str) -> str:
+    """Stable chat identifier (hash() is randomized per process)"""
+    return hashlib.sha1(chat_name.encode("utf-8")).hexdigest()[:16]
+
+
+def phone_digits(target: str) -> Optional[str]:
+    """Digits of a phone-number chat target like "+91 98765-43210", else None"""
+    if not re.fullmatch(r"\+?[\d\s().-]{7,}", target.strip()):
+        return None
+    digits = re.sub(r"\D", "", target)
+    return digits if len(digits) >= 7 else None
+
+
+def message_sender(message: Dict) -> Optional[str]:
+    """Phone digits of whoever sent an incoming direct-chat message.
+
+    Read from the data-id ("false_<number>@c.us_<id>"), which the chat title
+    can't spoof. None for outgoing and group messages or unparsable ids.
+    """
+    parts = message.get("id", "").split("_")
+    if message.get("direction") != "in" or len(parts) < 3 or parts[0] != "false":
+        return None
+    number, _, server = parts[1].partition("@")
+    return number if server == "c.us" and number.isdigit() else None
+
+
+class MessageDeduper:
+    """Tracks handled messages by WhatsApp's per-message data-id.
+
+    Each chat keeps a high-water mark (id of the newest message seen) so the
+    extractor only returns newer messages. A bounded, evicting set of seen
+    ids guards against replays when the mark scrolls out of the rendered
+    window.
+    """
+
+    def __init__(self, max_seen: int = 10000):
+        self.max_seen = max_seen
+        self.high_water = {}
+        self.seen = OrderedDict()
+
+    def _remember(self, msg_id: str):
+        self.seen[msg_id] = True
+        self.seen.move_to_end(msg_id)
+        while len(self.seen) > self.max_seen:
+            self.seen.popitem(last=False)
+
+    def take_unseen(self, key: str, messages: List[Dict], limit: int = 0) -> List[Dict]:
+        """Return unseen messages oldest first and advance the chat's mark.
+
+        `limit` caps how many of the newest messages may count as new, for
+        chats without a usable high-water mark. Everything rendered is
+        remembered so older history is never replayed later.
+        """
+        candidates = messages[-limit:] if limit else messages
+        unseen = [m for m in candidates if m["id"] not in self.seen]
+
+        for message in messages:
+            self._remember(message["id"])
+        if messages:
+            self.high_water[key] = messages[-1]["id"]
+
+        return unseen
+
+    def stats(self) -> Dict:
+        return {"chats": len(self.high_water), "seen": len(self.seen)}
+
+
+class CheckpointStore:
+    """Write-ahead JSONL log of processing state.
+
+    Records per-chat progress (high-water mark, last handled preview, unread
+    count) and the reply status of each ingested message. Records are
+    appended in batches with one fsync per flush, and the log is rewritten
+    as a compact snapshot once it grows past `compact_every` lines.
+    Replaying the log on start lets the bot resume without re-answering or
+    skipping messages.
+    """
+
+    def __init__(
+        self,
+        path: str = "checkpoint.jsonl",
+        flush_interval: float = 1.0,
+        compact_every: int = 5000,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+
+        self.chats = {}
+        self.pending = {}
+        self.buffer = []
+        self.lines = 0
+        self.flusher = None
+
+        self.load()
+
+    def load(self):
+        """Replay the log, truncating a torn final line left by a crash"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r+b") as f:
+                good = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    good += len(line)
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        continue
+                    self.lines += 1
+                f.truncate(good)
+            logger.info(
+                f"💾 Checkpoint restored: {len(self.chats)} chats, "
+                f"{len(self.pending)} pending replies"
+            )
+        except Exception as e:
+            logger.error(f"❌ Checkpoint load error: {e}")
+
+    def _apply(self, record: Dict):
+        kind = record["t"]
+        if kind == "chat":
+            state = self.chats.setdefault(record["id"], {})
+            state.update({k: v for k, v in record.items() if k not in ("t", "id")})
+        elif kind == "pending":
+            self.pending[record["id"]] = {
+                "chat": record["chat"],
+                "message": record["message"],
+            }
+        elif kind == "done":
+            self.pending.pop(record["id"], None)
+
+    def _append(self, record: Dict):
+        self._apply(record)
+        self.buffer.append(record)
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self._run())
+
+    def update_chat(self, chat_id: str, **fields):
+        """Merge progress fields (name, hwm, print, unread) for a chat"""
+        self._append({"t": "chat", "id": chat_id, **fields})
+
+    def mark_pending(self, chat_name: str, message: Dict):
+        self._append(
+            {"t": "pending", "id": message["id"], "chat": chat_name, "message": message}
+        )
+
+    def mark_done(self, msg_id: str):
+        self._append({"t": "done", "id": msg_id})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write buffered records with a single fsync, compacting if due"""
+        if not self.buffer:
+            return
+
+        batch, self.buffer = self.buffer, []
+        if self.lines + len(batch) > self.compact_every:
+            # The snapshot already includes this batch
+            snapshot = [
+                {"t": "chat", "id": chat_id, **state}
+                for chat_id, state in self.chats.items()
+            ] + [
+                {"t": "pending", "id": msg_id, **entry}
+                for msg_id, entry in self.pending.items()
+            ]
+            await asyncio.to_thread(self._write_snapshot, snapshot)
+            self.lines = len(snapshot)
+        else:
+            await asyncio.to_thread(self._write_batch, batch)
+            self.lines += len(batch)
+
+    def _write_batch(self, batch: List[Dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record) + "\n" for record in batch)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_snapshot(self, snapshot: List[Dict]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(record) + "\n" for record in snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        logger.info(f"🗜️ Checkpoint compacted to {len(snapshot)} records")
+
+    async def close(self):
+        """Stop the flusher and write whatever is still buffered"""
+        if self.flusher:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+            self.flusher = None
+        await self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            "chats": len(self.chats),
+            "pending": len(self.pending),
+            "buffered": len(self.buffer),
+            "log_lines": self.lines,
+        }
+
+
+class ConversationStore:
+    """Per-chat conversation memory backed by SQLite.
+
+    Recent turns of hot chats live in an in-memory LRU; other chats are read
+    from disk on demand. Each chat keeps at most `max_turns` verbatim turns,
+    older ones are folded into a short extractive summary, so prompt size,
+    memory and storage all stay bounded however long a chat runs.
+    """
+
+    def __init__(
+        self,
+        path: str = "conversations.db",
+        hot_chats: int = 256,
+        max_turns: int = 20,
+        token_budget: int = 1500,
+        summary_chars: int = 1200,
+    ):
+        self.hot_chats = hot_chats
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_chars = summary_chars
+
+        self.hot = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, chat TEXT, role TEXT, text TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS turns_chat ON turns (chat, id)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (chat TEXT PRIMARY KEY, text TEXT)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def tokens(text: str) -> int:
+        """Rough token estimate (~4 characters per token)"""
+        return len(text) // 4 + 1
+
+    def _load(self, chat_id: str) -> Dict:
+        """Hot state for a chat, reading it from SQLite on a miss (locked)"""
+        state = self.hot.get(chat_id)
+        if state is None:
+            rows = self.db.execute(
+                "SELECT role, text FROM turns WHERE chat = ? ORDER BY id", (chat_id,)
+            ).fetchall()
+            summary = self.db.execute(
+                "SELECT text FROM summaries WHERE chat = ?", (chat_id,)
+            ).fetchone()
+            state = {"summary": summary[0] if summary else "", "turns": deque(rows)}
+            self.hot[chat_id] = state
+            while len(self.hot) > self.hot_chats:
+                self.hot.popitem(last=False)
+        self.hot.move_to_end(chat_id)
+        return state
+
+    def _add(self, chat_id: str, role: str, text: str):
+        with self.lock:
+            state = self._load(chat_id)
+            state["turns"].append((role, text))
+            self.db.execute(
+                "INSERT INTO turns (chat, role, text) VALUES (?, ?, ?)",
+                (chat_id, role, text),
+            )
+
+            overflow = len(state["turns"]) - self.max_turns
+            if overflow > 0:
+                folded = [state["turns"].popleft() for _ in range(overflow)]
+                state["summary"] = self._summarize(state["summary"], folded)
+                self.db.execute(
+                    "DELETE FROM turns WHERE id IN (SELECT id FROM turns "
+                    "WHERE chat = ? ORDER BY id LIMIT ?)",
+                    (chat_id, overflow),
+                )
+                self.db.execute(
+                    "INSERT OR REPLACE INTO summaries (chat, text) VALUES (?, ?)",
+                    (chat_id, state["summary"]),
+                )
+            self.db.commit()
+
+    def _summarize(self, summary: str, turns: List) -> str:
+        """Fold turns into the summary: first sentence of each, newest kept"""
+        notes = []
+        for role, text in turns:
+            sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+            notes.append(f"{role}: {sentence[:120]}")
+        combined = " | ".join(filter(None, [summary] + notes))
+        return combined[-self.summary_chars :]
+
+    def _build(self, chat_id: str, query: str) -> str:
+        with self.lock:
+            state = self._load(chat_id)
+            summary = state["summary"]
+            turns = list(state["turns"])
+
+        if not summary and not turns:
+            return query
+
+        budget = self.token_budget - self.tokens(query)
+        lines = []
+        for role, text in reversed(turns):
+            line = f"{role}: {text}"
+            cost = self.tokens(line)
+            if cost > budget:
+                break
+            lines.append(line)
+            budget -= cost
+        lines.reverse()
+
+        if summary and budget > 0:
+            lines.insert(0, f"(earlier: {summary[-budget * 4:]})")
+
+        history = "\n".join(lines)
+        return f"Conversation so far:\n{history}\n\nuser: {query}"
+
+    async def add_turn(self, chat_id: str, role: str, text: str):
+        await asyncio.to_thread(self._add, chat_id, role, text)
+
+    async def build_prompt(self, chat_id: str, query: str) -> str:
+        """Prompt with as much recent history as fits the token budget"""
+        return await asyncio.to_thread(self._build, chat_id, query)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def stats(self) -> Dict:
+        return {"hot_chats": len(self.hot)}
+
+
+class BlobWriter:
+    """Streams one blob to a temp file, hashing it on the way (worker thread)"""
+
+    def __init__(self, store: "MediaStore"):
+        self.store = store
+        self.digest = hashlib.sha256()
+        self.size = 0
+        fd, self.path = tempfile.mkstemp(dir=store.tmp_dir)
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes):
+        self.digest.update(data)
+        self.size += len(data)
+        self.file.write(data)
+
+    def commit(self, msg_id: str, chat: str, mime: str) -> Tuple[str, bool]:
+        self.file.close()
+        return self.store._commit(self, msg_id, chat, mime)
+
+    def discard(self):
+        self.file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+
+class MediaStore:
+    """Content-addressed store for media captured from chats.
+
+    Blobs are stored once under root/<sha256[:2]>/<sha256>, however many
+    chats they were sent to. A SQLite index maps message ids to blobs (with
+    chat, mime type and capture time) and tracks last access; once the
+    store outgrows `quota` bytes the least recently used blobs are evicted.
+    """
+
+    def __init__(self, root: str = "media", quota: int = 1 << 30):
+        self.root = root
+        self.quota = quota
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.lock = threading.Lock()
+        self.db = None
+        self.total = 0
+
+        # Metrics
+        self.stored = 0
+        self.deduplicated = 0
+        self.evicted = 0
+
+    def setup(self):
+        """Create the directory and index (called at startup, not import)"""
+        if self.db is not None:
+            return
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self.db = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "sha TEXT PRIMARY KEY, size INTEGER, mime TEXT, created REAL, accessed REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS captures ("
+            "msg_id TEXT PRIMARY KEY, chat TEXT, sha TEXT, captured REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS captures_sha ON captures (sha)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed)")
+        self.db.commit()
+        self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def blob_path(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], sha)
+
+    def lookup(self, msg_id: str) -> Optional[Dict]:
+        """Capture record for a message, if its media is in the store"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT c.sha, c.chat, c.captured, b.size, b.mime FROM captures c "
+                "JOIN blobs b ON b.sha = c.sha WHERE c.msg_id = ?",
+                (msg_id,),
+            ).fetchone()
+        if not row:
+            return None
+        return dict(zip(("sha", "chat", "captured", "size", "mime"), row))
+
+    def writer(self) -> BlobWriter:
+        return BlobWriter(self)
+
+    def _commit(self, writer: BlobWriter, msg_id: str, chat: str, mime: str):
+        sha = writer.digest.hexdigest()
+        now = time.time()
+        with self.lock:
+            known = self.db.execute("SELECT 1 FROM blobs WHERE sha = ?", (sha,)).fetchone()
+            if known:
+                os.unlink(writer.path)
+                self.deduplicated += 1
+                self.db.execute("UPDATE blobs SET accessed = ? WHERE sha = ?", (now, sha))
+            else:
+                os.makedirs(os.path.dirname(self.blob_path(sha)), exist_ok=True)
+                os.replace(writer.path, self.blob_path(sha))
+                self.stored += 1
+                self.total += writer.size
+                self.db.execute(
+                    "INSERT INTO blobs (sha, size, mime, created, accessed) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (sha, writer.size, mime, now, now),
+                )
+            self.db.execute(
+                "INSERT OR REPLACE INTO captures (msg_id, chat, sha, captured) "
+                "VALUES (?, ?, ?, ?)",
+                (msg_id, chat, sha, now),
+            )
+            self._evict(keep=sha)
+            self.db.commit()
+        return sha, not known
+
+    def _evict(self, keep: str):
+        """Drop least recently used blobs until under quota (locked)"""
+        while self.total > self.quota:
+            row = self.db.execute(
+                "SELECT sha, size FROM blobs WHERE sha != ? ORDER BY accessed LIMIT 1",
+                (keep,),
+            ).fetchone()
+            if not row:
+                break
+            sha, size = row
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.blob_path(sha))
+            self.db.execute("DELETE FROM blobs WHERE sha = ?", (sha,))
+            self.db.execute("DELETE FROM captures WHERE sha = ?", (sha,))
+            self.total -= size
+            self.evicted += 1
+
+    def open(self, sha: str) -> Optional[Tuple[str, str]]:
+        """(path, mime) of a stored blob, marking it recently used"""
+        with self.lock:
+            row = self.db.execute("SELECT mime FROM blobs WHERE sha = ?", (sha,)).fetchone()
+            if not row or not os.path.exists(self.blob_path(sha)):
+                return None
+            self.db.execute("UPDATE blobs SET accessed = ? WHERE sha = ?", (time.time(), sha))
+            self.db.commit()
+        return self.blob_path(sha), row[0]
+
+    def captures(self, chat: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        """Newest captures first, optionally for one chat"""
+        query = (
+            "SELECT c.msg_id, c.chat, c.sha, c.captured, b.size, b.mime FROM captures c "
+            "JOIN blobs b ON b.sha = c.sha"
+        )
+        args = []
+        if chat:
+            query += " WHERE c.chat = ?"
+            args.append(chat)
+        query += " ORDER BY c.captured DESC LIMIT ?"
+        args.append(limit)
+        with self.lock:
+            rows = self.db.execute(query, args).fetchall()
+        keys = ("msg_id", "chat", "sha", "captured", "size", "mime")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def stats(self) -> Dict:
+        return {
+            "bytes": self.total,
+            "quota_bytes": self.quota,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "evicted": self.evicted,
+        }
+
+
+class ImageCache:
+    """Outgoing images resized and recompressed once, reused on every send.
+
+    Prepared copies (longest side at most `max_side`, JPEG at `quality`)
+    are named after the source's SHA-256, so identical files share one
+    entry and an edited file gets a new one. The hash is memoized per
+    (path, mtime, size) so unchanged files are not re-read. The oldest
+    copies are pruned beyond `max_entries`.
+    """
+
+    def __init__(
+        self,
+        root: str = "image-cache",
+        max_side: int = 1600,
+        quality: int = 80,
+        max_entries: int = 256,
+    ):
+        self.root = root
+        self.max_side = max_side
+        self.quality = quality
+        self.max_entries = max_entries
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def setup(self):
+        """Create the cache directory (called at startup, not import)"""
+        os.makedirs(self.root, exist_ok=True)
+
+    def _digest(self, path: str) -> str:
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        digest = self.hashes.get(key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+            digest = self.hashes[key] = sha.hexdigest()
+        return digest
+
+    def prepare(self, path: str) -> str:
+        """Path of the send-ready copy of path; path itself if it can't be
+        prepared (not an image, Pillow missing). Worker thread."""
+        try:
+            digest = self._digest(path)
+            target = os.path.join(
+                self.root, f"{digest}-{self.max_side}-{self.quality}.jpg"
+            )
+            with self.lock:
+                if os.path.exists(target):
+                    self.hits += 1
+                    return target
+                self.misses += 1
+
+                with Image.open(path) as img:
+                    small_jpeg = img.format == "JPEG" and max(img.size) <= self.max_side
+                    img = ImageOps.exif_transpose(img)
+                    img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+                    if img.mode in ("RGBA", "LA", "P"):
+                        img = img.convert("RGBA")
+                        flat = Image.new("RGB", img.size, "white")
+                        flat.paste(img, mask=img.getchannel("A"))
+                        img = flat
+                    elif img.mode != "RGB":
+                        img = img.convert("RGB")
+                    temp = f"{target}.tmp"
+                    img.save(
+                        temp, "JPEG", quality=self.quality, optimize=True, progressive=True
+                    )
+
+                # Already a small, well compressed JPEG: keep the original bytes
+                original = os.path.getsize(path)
+                if small_jpeg and os.path.getsize(temp) >= original:
+                    shutil.copyfile(path, temp)
+                self.bytes_saved += original - os.path.getsize(temp)
+                os.replace(temp, target)
+                self._prune()
+                return target
+        except Exception as e:
+            logger.warning(f"⚠️ Image prep failed for {path}, sending as is: {e}")
+            return path
+
+    def _prune(self):
+        """Drop the oldest prepared copies beyond max_entries (locked)"""
+        entries = [
+            os.path.join(self.root, name)
+            for name in os.listdir(self.root)
+            if name.endswith(".jpg")
+        ]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=os.path.getmtime)
+        for stale in entries[: len(entries) - self.max_entries]:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(stale)
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+class ReplyChunker:
+    """Splits streamed text into WhatsApp-sized messages at natural breaks.
+
+    A chunk is released as soon as a paragraph break appears past
+    `min_chars`, or once the buffer exceeds `max_chars`, in which case it is
+    cut at the last paragraph, sentence or word boundary that fits.
+    """
+
+    SENTENCE_END = re.compile(r"[.!?](?=\s)")
+
+    def __init__(self, max_chars: int = 1500, min_chars: int = 200):
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self.buffer += text
+        chunks = []
+        while True:
+            cut = self._cut()
+            if cut is None:
+                return chunks
+            chunk, self.buffer = self.buffer[:cut].strip(), self.buffer[cut:]
+            if chunk:
+                chunks.append(chunk)
+
+    def flush(self) -> List[str]:
+        """Release everything left once generation is done"""
+        chunks = []
+        while len(self.buffer) > self.max_chars:
+            chunks.extend(self.feed(""))
+        if self.buffer.strip():
+            chunks.append(self.buffer.strip())
+        self.buffer = ""
+        return chunks
+
+    def _cut(self) -> Optional[int]:
+        window = self.buffer[: self.max_chars]
+        paragraph = window.rfind("\n\n")
+        if paragraph >= self.min_chars:
+            return paragraph + 2
+        if len(self.buffer) <= self.max_chars:
+            return None
+
+        sentences = [m.end() for m in self.SENTENCE_END.finditer(window)]
+        if sentences and sentences[-1] >= self.min_chars:
+            return sentences[-1]
+        space = window.rfind(" ")
+        return space + 1 if space >= self.min_chars else self.max_chars
+
+
+class SessionProfile:
+    """Persistent Chrome profile holding the WhatsApp Web login.
+
+    WhatsApp keeps its keys in IndexedDB and localStorage, which cookies
+    don't cover, so Chrome runs on a dedicated --user-data-dir. snapshot()
+    packs the login-relevant parts into a tar.gz with a sha256 manifest so a
+    redeployed container can restore() them instead of pairing again;
+    archives that fail verification are refused.
+
+    The root holds two profile slots, "a" and "b", plus an ACTIVE pointer:
+    a standby Chrome waits on the other slot and becomes active on handover.
+    """
+
+    # Login state only; caches are large and rebuilt by Chrome
+    KEEP = (
+        "Local State",
+        "Default/Preferences",
+        "Default/Cookies",
+        "Default/Network",
+        "Default/IndexedDB",
+        "Default/Local Storage",
+        "Default/Session Storage",
+    )
+    # Storage Chrome opens lazily per origin, so it can be copied into a
+    # standby that is idling on about:blank
+    HANDOVER = ("Default/IndexedDB", "Default/Local Storage", "Default/Session Storage")
+    WHATSAPP_DB = "Default/IndexedDB/https_web.whatsapp.com_0.indexeddb.leveldb"
+    MANIFEST = "MANIFEST.json"
+    SLOTS = ("a", "b")
+
+    def __init__(self, root: str, archive: str = ""):
+        self.root = os.path.abspath(root)
+        self.archive = archive
+        self.restored = False
+        self.last_snapshot = None
+        try:
+            with open(os.path.join(self.root, "ACTIVE")) as f:
+                self.slot = f.read().strip()
+        except OSError:
+            self.slot = ""
+        if self.slot not in self.SLOTS:
+            self.slot = self.SLOTS[0]
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.root, self.slot)
+
+    @property
+    def standby_path(self) -> str:
+        return os.path.join(self.root, self.SLOTS[self.slot == self.SLOTS[0]])
+
+    def has_login(self) -> bool:
+        """Fast probe: has WhatsApp Web stored anything in this profile?"""
+        try:
+            with os.scandir(os.path.join(self.path, self.WHATSAPP_DB)) as entries:
+                return any(entry.name.endswith((".ldb", ".log")) for entry in entries)
+        except OSError:
+            return False
+
+    def prepare(self):
+        """Restore from the archive if needed and clear stale profile locks"""
+        if not self.has_login() and self.archive and os.path.exists(self.archive):
+            try:
+                self.restore()
+            except Exception as e:
+                logger.error(f"❌ Session restore failed: {e}")
+
+        self.clear_locks(self.path)
+
+    @staticmethod
+    def clear_locks(path: str):
+        """Create the profile dir and drop locks left by a dead Chrome"""
+        os.makedirs(path, exist_ok=True)
+        # Left behind by a crashed Chrome, possibly on another host
+        for name in ("SingletonLock", "SingletonSocket", "SingletonCookie"):
+            try:
+                os.unlink(os.path.join(path, name))
+            except OSError:
+                pass
+
+    def sync_to(self, dest: str):
+        """Copy the WhatsApp login storage from the active slot into dest"""
+        for name in self.HANDOVER:
+            target = os.path.join(dest, name)
+            shutil.rmtree(target, ignore_errors=True)
+            source = os.path.join(self.path, name)
+            if os.path.isdir(source):
+                shutil.copytree(
+                    source, target, ignore=shutil.ignore_patterns("LOCK")
+                )
+
+    def switch(self):
+        """Make the standby slot the active one, durably"""
+        self.slot = self.SLOTS[self.slot == self.SLOTS[0]]
+        pointer = os.path.join(self.root, "ACTIVE")
+        with open(f"{pointer}.tmp", "w") as f:
+            f.write(self.slot)
+        os.replace(f"{pointer}.tmp", pointer)
+
+    def _files(self) -> List[str]:
+        files = []
+        for keep in self.KEEP:
+            top = os.path.join(self.path, keep)
+            if os.path.isfile(top):
+                files.append(keep)
+            for root, _, names in os.walk(top):
+                for name in names:
+                    full = os.path.join(root, name)
+                    if os.path.isfile(full) and not os.path.islink(full):
+                        files.append(os.path.relpath(full, self.path))
+        return sorted(files)
+
+    @staticmethod
+    def _digest(path: str) -> str:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def snapshot(self) -> bool:
+        """Write the archive atomically, plus a .sha256 sidecar for it"""
+        if not self.archive or not self.has_login():
+            return False
+
+        files = {}
+        temp = f"{self.archive}.tmp"
+        with tarfile.open(temp, "w:gz") as tar:
+            for name in self._files():
+                full = os.path.join(self.path, name)
+                try:
+                    with open(full, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue  # Chrome removed it mid-snapshot
+                files[name] = {
+                    "size": len(data),
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                }
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(os.path.getmtime(full))
+                tar.addfile(info, io.BytesIO(data))
+
+            manifest = json.dumps(
+                {"version": 1, "created": time.time(), "files": files}, indent=1
+            ).encode()
+            info = tarfile.TarInfo(self.MANIFEST)
+            info.size = len(manifest)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(manifest))
+
+        with open(temp, "rb") as f:
+            os.fsync(f.fileno())
+        digest = self._digest(temp)
+        os.replace(temp, self.archive)
+        with open(f"{self.archive}.sha256.tmp", "w") as f:
+            f.write(digest + "\n")
+        os.replace(f"{self.archive}.sha256.tmp", f"{self.archive}.sha256")
+
+        self.last_snapshot = time.time()
+        logger.info(f"💾 Session snapshot: {len(files)} files")
+        return True
+
+    def restore(self):
+        """Verify the archive and swap it in as the profile, or raise"""
+        sidecar = f"{self.archive}.sha256"
+        if os.path.exists(sidecar):
+            with open(sidecar) as f:
+                expected = f.read().strip()
+            if self._digest(self.archive) != expected:
+                raise ValueError("archive checksum mismatch")
+
+        staging = f"{self.path}.restore"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        try:
+            with tarfile.open(self.archive, "r:gz") as tar:
+                members = tar.getmembers()
+                for member in members:
+                    name = os.path.normpath(member.name)
+                    if (
+                        not member.isfile()
+                        or os.path.isabs(name)
+                        or name.startswith("..")
+                    ):
+                        raise ValueError(f"unsafe archive entry: {member.name}")
+                tar.extractall(staging, members=members)
+
+            with open(os.path.join(staging, self.MANIFEST)) as f:
+                files = json.load(f)["files"]
+            for name, meta in files.items():
+                full = os.path.join(staging, name)
+                if (
+                    os.path.getsize(full) != meta["size"]
+                    or self._digest(full) != meta["sha256"]
+                ):
+                    raise ValueError(f"corrupt file in archive: {name}")
+            os.unlink(os.path.join(staging, self.MANIFEST))
+
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.replace(staging, self.path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.restored = True
+        logger.info(f"♻️ Session restored from {self.archive} ({len(files)} files)")
+
+    def stats(self) -> Dict:
+        return {
+            "profile": self.path,
+            "slot": self.slot,
+            "logged_in": self.has_login(),
+            "restored": self.restored,
+            "archive": self.archive,
+            "archive_bytes": (
+                os.path.getsize(self.archive)
+                if self.archive and os.path.exists(self.archive)
+                else 0
+            ),
+            "last_snapshot": self.last_snapshot,
+        }
+
+
+class BrowserSupervisor:
+    """Keeps a warm standby Chrome and swaps it in on /restart or a crash.
+
+    The standby is launched ahead of time on the profile's other slot and
+    idles there. A handover stops the monitor, takes the UI lock so nothing
+    is mid-send, quits the old browser, copies the login storage across and
+    points the bot at the standby's driver. Queues, checkpoint, dedup and
+    conversations stay in the same bot, and the restarted monitor's
+    resume() catches up on whatever arrived during the swap.
+    """
+
+    # A single WebDriver command running longer than this means Chrome hung
+    HUNG_AFTER = 150
+
+    def __init__(self, bot, standby: bool = True, interval: float = 5):
+        self.bot = bot
+        self.enabled = standby
+        self.interval = interval
+        self.standby = None
+        self.standby_task = None
+        self.lock = asyncio.Lock()
+        self.failed_checks = 0
+        self.failed_handovers = 0
+        # Processes of a replaced Chrome that would not die; the standby
+        # slot they used is not relaunched until they are gone
+        self.retired = []
+
+        # Metrics
+        self.handovers = 0
+        self.crashes = 0
+        self.monitor_restarts = 0
+        self.last_handover = None
+
+    async def run(self):
+        """Watch the browser and the monitor, recovering either when they die"""
+        while True:
+            # Back off while Chrome can't be started at all
+            await asyncio.sleep(
+                self.interval * min(2 ** self.failed_handovers, 12)
+            )
+            if self.lock.locked():
+                continue
+
+            try:
+                if self.enabled and self.standby is None and (
+                    self.standby_task is None or self.standby_task.done()
+                ):
+                    self.standby_task = self.bot.dispatch(self.prepare_standby())
+
+                if await self.healthy():
+                    self.failed_checks = 0
+                else:
+                    self.failed_checks += 1
+                    # Two misses in a row, so one slow command doesn't count
+                    if self.failed_checks >= 2:
+                        self.crashes += 1
+                        logger.warning("⚠️ Browser unresponsive, handing over")
+                        await self.handover("crash")
+                        continue
+
+                monitor = self.bot.monitor_task
+                if monitor is not None and monitor.done():
+                    self.monitor_restarts += 1
+                    logger.warning("⚠️ Monitor stopped, restarting it")
+                    self.bot.start_monitor()
+
+            except Exception as e:
+                logger.error(f"❌ Supervisor error: {e}")
+
+    async def healthy(self) -> bool:
+        """Cheap liveness check of chromedriver, Chrome and the driver thread"""
+        bot = self.bot
+        if bot.driver is None or not bot.actor.thread.is_alive():
+            return False
+        try:
+            if bot.driver.service.process.poll() is not None:
+                return False
+        except AttributeError:
+            pass
+
+        # A busy driver is alive unless one command has been stuck too long
+        if bot.actor.current_op is not None:
+            return time.monotonic() - bot.actor.op_started < self.HUNG_AFTER
+        ahead = bot.actor.commands.qsize()
+        try:
+            await bot.drive(bot.driver.execute_script, "return 1;", op="ping", timeout=10)
+            return True
+        except asyncio.TimeoutError:
+            # The ping queued behind other work: busy, not dead
+            if bot.actor.current_op is not None:
+                return time.monotonic() - bot.actor.op_started < self.HUNG_AFTER
+            return ahead > 0 or bot.actor.commands.qsize() > 1
+        except Exception:
+            return False
+
+    async def prepare_standby(self):
+        """Launch Chrome on the standby slot and leave it idle"""
+        path = self.bot.profile.standby_path
+        actor = DriverActor()
+        try:
+            if self.retired:
+                if not await asyncio.to_thread(kill_processes, self.retired, 5):
+                    raise RuntimeError("replaced Chrome is still running on this slot")
+                self.retired = []
+            await asyncio.to_thread(SessionProfile.clear_locks, path)
+            driver = await self.bot.launch_browser(actor, path)
+            self.standby = (actor, driver, path)
+            logger.info("🛟 Standby browser ready")
+        except Exception as e:
+            logger.error(f"❌ Standby browser launch failed: {e}")
+            await actor.stop(timeout=1)
+
+    async def handover(self, reason: str) -> bool:
+        """Swap the standby browser in for the current one"""
+        bot = self.bot
+        if self.lock.locked():
+            return False
+
+        async with self.lock:
+            started = time.monotonic()
+            if self.standby_task and not self.standby_task.done():
+                await asyncio.gather(self.standby_task, return_exceptions=True)
+            if self.standby is None:
+                # Nothing warm (disabled or failed), launch one now
+                await self.prepare_standby()
+            if self.standby is None:
+                self.failed_handovers += 1
+                return False
+            actor, driver, path = self.standby
+            self.standby = None
+
+            await bot.stop_monitor()
+            paused = time.monotonic()
+            async with bot.ui_lock:
+                old_actor, old_driver = bot.actor, bot.driver
+                old_pids = []
+                if old_driver is not None:
+                    # Snapshot the tree first: once chromedriver dies its
+                    # Chrome children are reparented and can't be found
+                    with contextlib.suppress(AttributeError, OSError):
+                        old_pids = process_tree(old_driver.service.process.pid)
+                    try:
+                        await old_actor.call(old_driver.quit, op="quit", timeout=10)
+                    except Exception:
+                        pass  # Dead, or hung behind a stuck command
+                await old_actor.stop(timeout=2)
+
+                # quit() can't get through to a hung driver; whatever is left
+                # must be gone before its storage is copied
+                if await asyncio.to_thread(kill_processes, old_pids):
+                    with contextlib.suppress(AttributeError, OSError):
+                        old_driver.service.process.poll()  # Reap chromedriver
+                    await asyncio.to_thread(bot.profile.sync_to, path)
+                else:
+                    self.retired = old_pids
+                    logger.error(
+                        "❌ Old Chrome did not exit; keeping the standby's own login copy"
+                    )
+                bot.profile.switch()
+                bot.actor, bot.driver = actor, driver
+                bot.current_chat = None
+                bot.is_connected = False
+                bot.resumed = False
+
+                logged_in = await bot.load_session()
+                if not logged_in:
+                    # Still show WhatsApp so pairing can continue
+                    try:
+                        await bot.drive(driver.get, bot.config["WHATSAPP_URL"], op="get")
+                    except Exception as e:
+                        logger.error(f"❌ Standby navigation failed: {e}")
+            bot.start_monitor()
+
+            self.failed_checks = 0
+            self.failed_handovers = 0
+            self.handovers += 1
+            self.last_handover = {
+                "reason": reason,
+                "seconds": round(time.monotonic() - started, 3),
+                "paused_seconds": round(time.monotonic() - paused, 3),
+                "logged_in": logged_in,
+                "at": time.time(),
+            }
+            logger.info(
+                f"🔁 Browser handover ({reason}): monitor paused "
+                f"{self.last_handover['paused_seconds']:.2f}s"
+            )
+
+        if self.enabled:
+            self.standby_task = bot.dispatch(self.prepare_standby())
+        return True
+
+    async def close(self):
+        """Quit the standby browser"""
+        if self.standby_task and not self.standby_task.done():
+            self.standby_task.cancel()
+            await asyncio.gather(self.standby_task, return_exceptions=True)
+        if self.standby:
+            actor, driver, _ = self.standby
+            self.standby = None
+            try:
+                await actor.call(driver.quit, op="quit", timeout=10)
+            except Exception:
+                pass
+            await actor.stop(timeout=2)
+
+    def stats(self) -> Dict:
+        return {
+            "standby_ready": self.standby is not None,
+            "handovers": self.handovers,
+            "crashes": self.crashes,
+            "monitor_restarts": self.monitor_restarts,
+            "last_handover": self.last_handover,
+        }
+
+
+class PollScheduler:
+    """Paces the monitor loop by recent traffic.
+
+    Activity (or a backlog of replies still being handled) snaps the tick
+    interval to `fast`; each quiet tick stretches it by `backoff`, up to
+    `slow`. The observer buffers chat activity in the page, so a long idle
+    interval only adds latency to the first message of a burst. A full
+    connection check runs every `connection_every` seconds or after a
+    failed tick, since a successful drain already shows the page is up.
+    """
+
+    def __init__(
+        self,
+        fast: float = 0.5,
+        slow: float = 10.0,
+        backoff: float = 1.5,
+        connection_every: float = 30.0,
+    ):
+        self.fast = fast
+        self.slow = max(slow, fast)
+        self.backoff = max(backoff, 1.0)
+        self.connection_every = connection_every
+        self.interval = fast
+        self.backlog = 0
+        self.last_check = None
+        self.wakeup = asyncio.Event()
+
+        # Metrics
+        self.ticks = 0
+        self.idle_ticks = 0
+        self.connection_checks = 0
+
+    def connection_due(self) -> bool:
+        return (
+            self.last_check is None
+            or time.monotonic() - self.last_check >= self.connection_every
+        )
+
+    def connection_checked(self, ok: bool):
+        self.connection_checks += 1
+        # A failed check is repeated on the next tick
+        self.last_check = time.monotonic() if ok else None
+
+    def record(self, activity: int, backlog: int) -> float:
+        """Account for one tick and return the delay before the next"""
+        self.ticks += 1
+        self.backlog = backlog
+        # A poke during the tick counts as activity
+        if activity or backlog or self.wakeup.is_set():
+            self.interval = self.fast
+        else:
+            self.idle_ticks += 1
+            self.interval = min(self.slow, self.interval * self.backoff)
+        return self.interval
+
+    def poke(self):
+        """Traffic seen elsewhere (a reply went out): tick fast again now"""
+        self.interval = self.fast
+        self.wakeup.set()
+
+    def failed(self):
+        self.last_check = None
+        self.interval = self.fast
+
+    async def sleep(self):
+        """Wait out the interval; a poke since the last wakeup returns at once"""
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.wakeup.wait(), self.interval)
+        self.wakeup.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "interval": round(self.interval, 3),
+            "backlog": self.backlog,
+            "ticks": self.ticks,
+            "idle_ticks": self.idle_ticks,
+            "connection_checks": self.connection_checks,
+        }
+
+
+class WrongChatError(RuntimeError):
+    """A different chat than expected is in the foreground"""
+
 
 class ZohaAIBot:
     def __init__(self):
         self.config = self.load_config()
         self.driver = None
+        self.actor = DriverActor()
         self.is_connected = False
         self.qr_data = None
         self.pairing_code = None
-
-        # AI Setup
+        self.current_chat = None
+        # Chat target (a phone number or stale title) -> verified header title
+        self.chat_titles = OrderedDict()
+        self.navigation = Counter()
+        self.chat_fingerprints = {}
+        self.dedup = MessageDeduper(self.config["DEDUP_MAX_SEEN"])
+
+        # Resume from the last checkpoint instead of replaying history
+        self.checkpoint = CheckpointStore(
+            self.config["CHECKPOINT_FILE"],
+            flush_interval=self.config["CHECKPOINT_FLUSH_INTERVAL"],
+            compact_every=self.config["CHECKPOINT_COMPACT_EVERY"],
+        )
+        for chat_id, state in self.checkpoint.chats.items():
+            if state.get("hwm"):
+                self.dedup.high_water[chat_id] = state["hwm"]
+                self.dedup._remember(state["hwm"])
+        self.resumed = False
+        # Pending replies are replayed once per process; later resumes
+        # (handover, deep-link reload) only catch up on the chat list
+        self.pending_replayed = False
+
+        # Serializes chat navigation so concurrent replies land in the right chat
+        self.ui_lock = asyncio.Lock()
+        # chat_id -> {"lock", "users"}: one chat's batches run one at a time
+        self.chat_locks = {}
+        self.tasks = set()
+        self.ack_timeouts = 0
+
+        # AI Setup, done by setup_ai() during start()
         self.gemini_client = None
-        if self.config.get("GEMINI_API_KEY"):
-            genai.configure(api_key=self.config["GEMINI_API_KEY"])
-            self.gemini_client = genai.GenerativeModel("gemini-pro")
+        self.ai = None
+        self.ai_setup = None
+
+        # Phase durations in seconds, filled in by start(); *_at entries
+        # are milestones in seconds since the process was launched
+        self.startup = {}
+
+        self.response_cache = ResponseCache(
+            max_size=self.config["AI_CACHE_SIZE"],
+            ttl=self.config["AI_CACHE_TTL"],
+            path=self.config["AI_CACHE_FILE"],
+        )
+        self.ai_flights = SingleFlight()
+
+        self.conversations = ConversationStore(
+            self.config["CONVO_DB"],
+            hot_chats=self.config["CONVO_HOT_CHATS"],
+            max_turns=self.config["CONVO_MAX_TURNS"],
+            token_budget=self.config["CONVO_TOKEN_BUDGET"],
+        )
+
+        self.outbound = OutboundQueue(
+            self.deliver,
+            rate=self.config["OUTBOUND_RATE"],
+            burst=self.config["OUTBOUND_BURST"],
+            coalesce_chars=self.config["OUTBOUND_COALESCE_CHARS"],
+            is_open=self.is_open,
+        )
+        self.broadcaster = Broadcaster(
+            self,
+            self.config["BROADCAST_FILE"],
+            window=self.config["BROADCAST_WINDOW"],
+            retries=self.config["BROADCAST_RETRIES"],
+            max_seconds=self.config["BROADCAST_MAX_SECONDS"],
+        )
 
-        # Session
-        self.session_file = "session.pkl"
-        self.cookies_file = "cookies.pkl"
+        # Session: a persistent Chrome profile, archived for redeploys
+        self.profile = SessionProfile(
+            self.config["CHROME_PROFILE_DIR"], self.config["SESSION_ARCHIVE"]
+        )
+        self.monitor_task = None
+        # Set once start() has tried to launch Chrome; launches hold the lock
+        self.browser_attempted = asyncio.Event()
+        self.browser_lock = asyncio.Lock()
+        self.scheduler = PollScheduler(
+            fast=self.config["MONITOR_FAST_INTERVAL"],
+            slow=self.config["MONITOR_SLOW_INTERVAL"],
+            backoff=self.config["MONITOR_BACKOFF"],
+            connection_every=self.config["CONNECTION_CHECK_INTERVAL"],
+        )
+        # Holders of media_unblocked(); media is blocked again at zero
+        self.media_users = 0
+        self.supervisor = BrowserSupervisor(
+            self,
+            standby=self.config["STANDBY_BROWSER"],
+            interval=self.config["SUPERVISOR_INTERVAL"],
+        )
 
-        # Media tracking
-        self.media_sent = set()
-        self.last_media_check = {}
+        # Media captured from chats, deduplicated by content
+        self.media_store = MediaStore(
+            self.config["MEDIA_DIR"], quota=self.config["MEDIA_QUOTA_MB"] * 1024 * 1024
+        )
+        self.media_slots = asyncio.Semaphore(self.config["MEDIA_CONCURRENCY"])
 
         # Profile picture path
         self.profile_pic_path = "assets/profile.jpg"
+        self.images = ImageCache(
+            self.config["IMAGE_CACHE_DIR"],
+            max_side=self.config["IMAGE_MAX_SIDE"],
+            quality=self.config["IMAGE_QUALITY"],
+        )
 
         logger.info(f"🤖 {self.config['BOT_NAME']} initialized")
 
@@ -73,79 +3137,318 @@ class ZohaAIBot:
                 if num.strip()
             ],
             "PORT": int(os.getenv("PORT", 8000)),
+            # Required by the debug endpoints (X-Admin-Token header or ?token=)
+            "ADMIN_TOKEN": os.getenv("ADMIN_TOKEN", ""),
             "HEADLESS": os.getenv("HEADLESS", "true").lower() == "true",
+            "WHATSAPP_URL": os.getenv("WHATSAPP_URL", "https://web.whatsapp.com"),
+            "CHROME_BIN": os.getenv("CHROME_BIN", "/usr/bin/chromium"),
+            "CHROMEDRIVER_PATH": os.getenv("CHROMEDRIVER_PATH", "/usr/bin/chromedriver"),
+            # "lean" trims Chrome (blocked assets, small viewport) or "full"
+            "BROWSER_PROFILE": os.getenv("BROWSER_PROFILE", "full").lower(),
+            "RENDERER_MAX_HEAP_MB": int(os.getenv("RENDERER_MAX_HEAP_MB", 512)),
+            # Chrome --user-data-dir holding the login, and its redeploy archive
+            "CHROME_PROFILE_DIR": os.getenv("CHROME_PROFILE_DIR", "chrome-profile"),
+            "SESSION_ARCHIVE": os.getenv("SESSION_ARCHIVE", "session.tar.gz"),
+            "SESSION_SNAPSHOT_INTERVAL": float(
+                os.getenv("SESSION_SNAPSHOT_INTERVAL", 900)
+            ),
+            # Pre-launched second Chrome for fast /restart and crash recovery
+            "STANDBY_BROWSER": os.getenv("STANDBY_BROWSER", "true").lower() == "true",
+            "SUPERVISOR_INTERVAL": float(os.getenv("SUPERVISOR_INTERVAL", 5)),
+            # "observer" (push, MutationObserver) or "poll" (click each chat)
+            "INGEST_MODE": os.getenv("INGEST_MODE", "observer").lower(),
+            "DEDUP_MAX_SEEN": int(os.getenv("DEDUP_MAX_SEEN", 10000)),
+            "CHECKPOINT_FILE": os.getenv("CHECKPOINT_FILE", "checkpoint.jsonl"),
+            "CHECKPOINT_FLUSH_INTERVAL": float(
+                os.getenv("CHECKPOINT_FLUSH_INTERVAL", 1.0)
+            ),
+            "CHECKPOINT_COMPACT_EVERY": int(os.getenv("CHECKPOINT_COMPACT_EVERY", 5000)),
+            "AI_CONCURRENCY": int(os.getenv("AI_CONCURRENCY", 4)),
+            "AI_TIMEOUT": float(os.getenv("AI_TIMEOUT", 30)),
+            "AI_RETRIES": int(os.getenv("AI_RETRIES", 3)),
+            "AI_CACHE_SIZE": int(os.getenv("AI_CACHE_SIZE", 512)),
+            "AI_CACHE_TTL": float(os.getenv("AI_CACHE_TTL", 3600)),
+            # Set empty to keep the cache in memory only
+            "AI_CACHE_FILE": os.getenv("AI_CACHE_FILE", "ai_cache.json"),
+            # Stream long answers as they generate, in chunks of this size
+            "AI_STREAM": os.getenv("AI_STREAM", "true").lower() == "true",
+            "STREAM_CHUNK_CHARS": int(os.getenv("STREAM_CHUNK_CHARS", 1500)),
+            "STREAM_MIN_CHARS": int(os.getenv("STREAM_MIN_CHARS", 200)),
+            "CONVO_DB": os.getenv("CONVO_DB", "conversations.db"),
+            "CONVO_HOT_CHATS": int(os.getenv("CONVO_HOT_CHATS", 256)),
+            "CONVO_MAX_TURNS": int(os.getenv("CONVO_MAX_TURNS", 20)),
+            "CONVO_TOKEN_BUDGET": int(os.getenv("CONVO_TOKEN_BUDGET", 1500)),
+            # Per-chat send rate (messages/second) and burst allowance
+            "OUTBOUND_RATE": float(os.getenv("OUTBOUND_RATE", 1.0)),
+            "OUTBOUND_BURST": float(os.getenv("OUTBOUND_BURST", 5)),
+            "OUTBOUND_COALESCE_CHARS": int(os.getenv("OUTBOUND_COALESCE_CHARS", 300)),
+            "ACK_TIMEOUT": float(os.getenv("ACK_TIMEOUT", 10)),
+            # Broadcast job file, sends in flight per job, retries, time limit
+            "BROADCAST_FILE": os.getenv("BROADCAST_FILE", "broadcasts.json"),
+            "BROADCAST_WINDOW": int(os.getenv("BROADCAST_WINDOW", 8)),
+            "BROADCAST_RETRIES": int(os.getenv("BROADCAST_RETRIES", 2)),
+            "BROADCAST_MAX_SECONDS": float(os.getenv("BROADCAST_MAX_SECONDS", 1800)),
+            # Captured media: content-addressed store, size cap (LRU eviction),
+            # parallel downloads, transfer chunk size, wait for the download
+            "MEDIA_DIR": os.getenv("MEDIA_DIR", "media"),
+            "MEDIA_QUOTA_MB": int(os.getenv("MEDIA_QUOTA_MB", 1024)),
+            "MEDIA_MAX_FILE_MB": int(os.getenv("MEDIA_MAX_FILE_MB", 64)),
+            "MEDIA_CONCURRENCY": int(os.getenv("MEDIA_CONCURRENCY", 2)),
+            "MEDIA_CHUNK_KB": int(os.getenv("MEDIA_CHUNK_KB", 512)),
+            "MEDIA_TIMEOUT": float(os.getenv("MEDIA_TIMEOUT", 20)),
+            # Outgoing images are resized to this longest side and recompressed
+            "IMAGE_CACHE_DIR": os.getenv("IMAGE_CACHE_DIR", "image-cache"),
+            "IMAGE_MAX_SIDE": int(os.getenv("IMAGE_MAX_SIDE", 1600)),
+            "IMAGE_QUALITY": int(os.getenv("IMAGE_QUALITY", 80)),
+            # Monitor tick interval: fast under traffic, backing off to slow
+            # when idle; full connection checks every CONNECTION_CHECK_INTERVAL
+            "MONITOR_FAST_INTERVAL": float(os.getenv("MONITOR_FAST_INTERVAL", 0.5)),
+            "MONITOR_SLOW_INTERVAL": float(os.getenv("MONITOR_SLOW_INTERVAL", 10)),
+            "MONITOR_BACKOFF": float(os.getenv("MONITOR_BACKOFF", 1.5)),
+            "CONNECTION_CHECK_INTERVAL": float(
+                os.getenv("CONNECTION_CHECK_INTERVAL", 30)
+            ),
         }
 
+    def setup_stores(self):
+        """Create the on-disk media, image cache and broadcast state"""
+        self.media_store.setup()
+        self.images.setup()
+        self.broadcaster.load()
+
+    async def start(self):
+        """Cold start: independent phases run concurrently, then the monitor.
+
+        The Gemini SDK import and the profile picture download overlap the
+        browser launch; the monitor starts as soon as the session is loaded
+        (or right away, waiting for pairing) without waiting for either.
+        """
+        self.startup["boot"] = round(time.time() - PROCESS_STARTED_AT, 3)
+        started = time.monotonic()
+        os.makedirs("assets", exist_ok=True)
+
+        self.ai_setup = self.dispatch(self.timed("ai", self.setup_ai()))
+        profile_pic = self.dispatch(
+            self.timed("profile_pic", self.download_profile_pic())
+        )
+
+        logged_in = False
+        try:
+            async with self.browser_lock:
+                launched = await self.timed("browser", self.setup_browser())
+        finally:
+            self.browser_attempted.set()
+        if launched:
+            logged_in = await self.timed("session", self.load_session())
+
+        # Monitor waits for a connection itself, so it also covers pairing
+        self.start_monitor()
+        self.dispatch(self.snapshot_session())
+        self.dispatch(self.supervisor.run())
+        self.broadcaster.resume()
+        self.startup["monitor_at"] = round(time.time() - PROCESS_STARTED_AT, 3)
+        if not logged_in:
+            logger.info("⏳ Waiting for pairing...")
+
+        await asyncio.gather(self.ai_setup, profile_pic, return_exceptions=True)
+        self.startup["total"] = round(time.monotonic() - started, 3)
+        logger.info(
+            "⏱️ Startup: "
+            + " | ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup.items())
+        )
+
+    async def timed(self, phase: str, coro):
+        """Await coro, recording how long it took under startup[phase]"""
+        started = time.monotonic()
+        try:
+            return await coro
+        finally:
+            self.startup[phase] = round(time.monotonic() - started, 3)
+
+    async def setup_ai(self):
+        """Import the Gemini SDK off the event loop and build the backend"""
+        if not self.config.get("GEMINI_API_KEY") or self.ai:
+            return
+
+        try:
+            await asyncio.to_thread(genai.resolve)
+            genai.configure(api_key=self.config["GEMINI_API_KEY"])
+            self.gemini_client = genai.GenerativeModel("gemini-pro")
+            self.ai = AIBackend(
+                self.gemini_client,
+                concurrency=self.config["AI_CONCURRENCY"],
+                timeout=self.config["AI_TIMEOUT"],
+                retries=self.config["AI_RETRIES"],
+            )
+        except Exception as e:
+            logger.error(f"❌ Gemini setup failed: {e}")
+
     async def setup_browser(self):
         """Setup Chrome browser for WhatsApp Web"""
         try:
-            options = Options()
+            await asyncio.to_thread(self.profile.prepare)
+            self.driver = await self.launch_browser(self.actor, self.profile.path)
 
-            # Point to the Chromium binary installed by the Dockerfile
-            options.binary_location = "/usr/bin/chromium"
+            logger.info("✅ Browser setup complete and stable")
+            return True
 
-            # Cloud-specific arguments for stability
-            options.add_argument("--headless=new")
-            options.add_argument("--no-sandbox")
-            options.add_argument("--disable-dev-shm-usage")
-            options.add_argument("--disable-gpu")
+        except Exception as e:
+            logger.error(f"❌ Browser setup failed: {e}")
+            return False
 
-            # Standard Zoha AI settings
-            options.add_argument("--window-size=1920,1080")
-            options.add_argument("--disable-blink-features=AutomationControlled")
-            options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            options.add_experimental_option("useAutomationExtension", False)
+    async def ensure_browser(self) -> bool:
+        """Wait for start()'s launch instead of racing it with a second Chrome
+        on the same profile; launch again only if that one failed"""
+        await self.browser_attempted.wait()
+        async with self.browser_lock:
+            if not self.driver:
+                await self.setup_browser()
+        return self.driver is not None
+
+    async def launch_browser(self, actor: DriverActor, profile_dir: str):
+        """Start Chrome on profile_dir from actor's thread and return the driver"""
+        # Selenium is imported here, on the driver thread
+        await actor.call(webdriver.resolve, op="import", timeout=60)
+        options = Options()
+
+        # Login survives restarts in the profile, not in cookies
+        options.add_argument(f"--user-data-dir={profile_dir}")
+        options.add_argument("--profile-directory=Default")
+
+        # Point to the Chromium binary installed by the Dockerfile
+        options.binary_location = self.config["CHROME_BIN"]
+
+        # Cloud-specific arguments for stability
+        options.add_argument("--headless=new")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--disable-gpu")
+
+        # Standard Zoha AI settings
+        lean = self.config["BROWSER_PROFILE"] == "lean"
+        if lean:
+            # Fewer rendered rows and pixels; still wide enough for two panes
+            options.add_argument("--window-size=1024,768")
+            for flag in LEAN_CHROME_FLAGS:
+                options.add_argument(flag)
             options.add_argument(
-                "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+                f"--js-flags=--max-old-space-size={self.config['RENDERER_MAX_HEAP_MB']}"
             )
+        else:
+            options.add_argument("--window-size=1920,1080")
+        options.add_argument("--disable-blink-features=AutomationControlled")
+        options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        options.add_experimental_option("useAutomationExtension", False)
+        options.add_argument(
+            "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+        )
 
-            # Explicitly set the service path to the driver we installed
-            service = Service(executable_path="/usr/bin/chromedriver")
+        # Explicitly set the service path to the driver we installed
+        service = Service(executable_path=self.config["CHROMEDRIVER_PATH"])
 
-            self.driver = webdriver.Chrome(service=service, options=options)
-            self.driver.execute_script(
+        def launch():
+            driver = webdriver.Chrome(service=service, options=options)
+            driver.execute_script(
                 "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
             )
+            if lean:
+                driver.execute_cdp_cmd("Network.enable", {})
+                driver.execute_cdp_cmd(
+                    "Network.setBlockedURLs",
+                    {"urls": LEAN_BLOCKED_URLS + MEDIA_BLOCKED_URLS},
+                )
+                driver.execute_cdp_cmd(
+                    "Page.addScriptToEvaluateOnNewDocument", {"source": NO_ANIMATION_JS}
+                )
+            return driver
 
-            logger.info("✅ Browser setup complete and stable")
-            return True
+        return await actor.call(launch, op="launch", timeout=120)
 
-        except Exception as e:
-            logger.error(f"❌ Browser setup failed: {e}")
-            return False
+    @contextlib.asynccontextmanager
+    async def media_unblocked(self):
+        """Let WhatsApp media download while the body runs (lean profile)"""
+        if self.config["BROWSER_PROFILE"] != "lean" or not self.driver:
+            yield
+            return
 
-    async def load_session(self):
-        """Load saved WhatsApp session"""
+        async def block(urls: List[str]):
+            try:
+                await self.drive(
+                    self.driver.execute_cdp_cmd,
+                    "Network.setBlockedURLs",
+                    {"urls": urls},
+                    op="cdp",
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Could not update blocked URLs: {e}")
+
+        self.media_users += 1
+        if self.media_users == 1:
+            await block(LEAN_BLOCKED_URLS)
+        try:
+            yield
+        finally:
+            self.media_users -= 1
+            if self.media_users == 0:
+                await block(LEAN_BLOCKED_URLS + MEDIA_BLOCKED_URLS)
+
+    def start_monitor(self):
+        self.monitor_task = self.dispatch(self.monitor_messages())
+
+    async def stop_monitor(self, timeout: float = 15):
+        """Cancel the monitor and wait for it, at most `timeout` seconds"""
+        if self.monitor_task:
+            self.monitor_task.cancel()
+            _, running = await asyncio.wait({self.monitor_task}, timeout=timeout)
+            if running:
+                logger.warning("⚠️ Monitor did not stop in time; moving on")
+            self.monitor_task = None
+
+    def dispatch(self, coro):
+        """Run a handler in the background so slow AI calls don't block ingestion"""
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def browser_usage(self) -> Tuple[int, float]:
+        """RSS and CPU seconds of chromedriver plus every Chrome process it spawned"""
         try:
-            if os.path.exists(self.cookies_file):
-                self.driver.get("https://web.whatsapp.com")
-            await asyncio.sleep(3)
+            return process_tree_usage(self.driver.service.process.pid)
+        except Exception:
+            return 0, 0.0
 
-            with open(self.cookies_file, "rb") as f:
-                cookies = pickle.load(f)
+    async def drive(self, fn, *args, op: Optional[str] = None, timeout: float = 30):
+        """Run a blocking WebDriver call on the driver thread"""
+        return await self.actor.call(fn, *args, op=op, timeout=timeout)
 
-            for cookie in cookies:
-                try:
-                    self.driver.add_cookie(cookie)
-                except:
-                    pass
+    async def load_session(self):
+        """Open WhatsApp Web on the saved profile; True once chats are shown"""
+        # Checked on disk first so a fresh profile goes straight to pairing
+        if not self.profile.has_login():
+            return False
 
-                    self.driver.refresh()
-                    await asyncio.sleep(5)
+        def restore():
+            self.driver.get(self.config["WHATSAPP_URL"])
+
+            # Done as soon as either the chat list or the QR code renders
+            chat_list = (By.CSS_SELECTOR, 'div[data-testid="chat-list"]')
+            WebDriverWait(self.driver, 60).until(
+                EC.any_of(
+                    EC.presence_of_element_located(chat_list),
+                    EC.presence_of_element_located(
+                        (By.CSS_SELECTOR, 'canvas[aria-label="Scan me!"]')
+                    ),
+                )
+            )
+            return bool(self.driver.find_elements(*chat_list))
 
-                # Check if logged in
-                try:
-                    WebDriverWait(self.driver, 15).until(
-                        EC.presence_of_element_located(
-                            (By.CSS_SELECTOR, 'div[data-testid="chat-list"]')
-                        )
-                    )
-                    self.is_connected = True
-                    logger.info("✅ Session loaded successfully")
-                    return True
-                except:
-                    logger.info("⚠️ Session expired or invalid")
-                    return False
+        try:
+            if await self.drive(restore, op="load_session", timeout=90):
+                self.is_connected = True
+                logger.info("✅ Session loaded successfully")
+                return True
+            logger.info("⚠️ Session expired or invalid")
 
         except Exception as e:
             logger.error(f"❌ Session load error: {e}")
@@ -165,25 +3468,32 @@ class ZohaAIBot:
                             with open("assets/profile.jpg", "wb") as f:
                                 f.write(await resp.read())
                             logger.info("✅ Downloaded profile picture")
-            except:
+            except Exception:
                 logger.warning("⚠️ Could not download profile picture")
 
+        # Pre-warm the image cache so the first .menu sends a ready copy
+        if os.path.exists(self.profile_pic_path):
+            await asyncio.to_thread(self.images.prepare, self.profile_pic_path)
+
     async def save_session(self):
-        """Save current session cookies"""
+        """Archive the login part of the Chrome profile"""
         try:
-            cookies = self.driver.get_cookies()
-            with open(self.cookies_file, "wb") as f:
-                pickle.dump(cookies, f)
-            logger.info("💾 Session saved")
-            return True
+            return await asyncio.to_thread(self.profile.snapshot)
         except Exception as e:
             logger.error(f"❌ Session save error: {e}")
             return False
 
+    async def snapshot_session(self):
+        """Archive the profile periodically while connected, for redeploys"""
+        while True:
+            await asyncio.sleep(self.config["SESSION_SNAPSHOT_INTERVAL"])
+            if self.is_connected:
+                await self.save_session()
+
     async def get_pairing_code(self, phone_number: str):
         """Generate a pairing code using a phone number"""
-        try:
-            self.driver.get("https://web.whatsapp.com")
+        def pair():
+            self.driver.get(self.config["WHATSAPP_URL"])
             # Wait for the "Link with phone number" button
             link_btn = WebDriverWait(self.driver, 20).until(
             EC.element_to_be_clickable((By.XPATH, '//*[contains(text(), "Link with phone number")]'))
@@ -201,7 +3511,10 @@ class ZohaAIBot:
             code_element = WebDriverWait(self.driver, 20).until(
             EC.presence_of_element_located((By.CSS_SELECTOR, 'div[data-ref]'))
         )
-            self.pairing_code = code_element.text
+            return code_element.text
+
+        try:
+            self.pairing_code = await self.drive(pair, op="pairing", timeout=90)
             return self.pairing_code
         except Exception as e:
             logger.error(f"❌ Pairing code generation failed: {e}")
@@ -211,18 +3524,22 @@ class ZohaAIBot:
     async def get_qr_code(self):
         """Generate QR code for pairing"""
         try:
-            self.driver.get("https://web.whatsapp.com")
-            await asyncio.sleep(5)
-
-            # Wait for QR code
-            qr_element = WebDriverWait(self.driver, 30).until(
-                EC.presence_of_element_located(
-                    (By.CSS_SELECTOR, 'canvas[aria-label="Scan me!"]')
+            await self.drive(self.driver.get, self.config["WHATSAPP_URL"], op="get")
+
+            # Wait for QR code and grab it as PNG in one driver command
+            qr_screenshot = await self.drive(
+                lambda: WebDriverWait(self.driver, 30)
+                .until(
+                    EC.presence_of_element_located(
+                        (By.CSS_SELECTOR, 'canvas[aria-label="Scan me!"]')
+                    )
                 )
+                .screenshot_as_png,
+                op="WebDriverWait",
+                timeout=40,
             )
 
             # Get QR as base64
-            qr_screenshot = qr_element.screenshot_as_png
             qr_base64 = base64.b64encode(qr_screenshot).decode()
 
             # Generate pairing code
@@ -240,143 +3557,520 @@ class ZohaAIBot:
             logger.error(f"❌ QR generation failed: {e}")
             return None
 
-    async def check_connection(self):
-        """Check if WhatsApp is connected"""
+    async def check_connection(self, wait: float = 5):
+        """Check if WhatsApp is connected, waiting up to `wait` seconds for
+        the chat list (0 looks once)"""
         try:
-            WebDriverWait(self.driver, 5).until(
-                EC.presence_of_element_located(
-                    (By.CSS_SELECTOR, 'div[data-testid="chat-list"]')
-                )
+            await self.drive(
+                lambda: WebDriverWait(self.driver, wait).until(
+                    EC.presence_of_element_located(
+                        (By.CSS_SELECTOR, 'div[data-testid="chat-list"]')
+                    )
+                ),
+                op="WebDriverWait",
+                timeout=wait + 5,
             )
             self.is_connected = True
             return True
-        except:
+        except Exception:
             self.is_connected = False
             return False
 
-    async def monitor_messages(self):
-        """Monitor for new messages and media"""
-        logger.info("👂 Starting message monitor...")
+    async def install_observer(self):
+        """Inject the chat-list MutationObserver (no-op if already running)"""
+        try:
+            return bool(
+                await self.drive(
+                    self.driver.execute_script, OBSERVER_JS, op="execute_script"
+                )
+            )
+        except Exception as e:
+            logger.error(f"❌ Observer install failed: {e}")
+            return False
 
-        last_processed = {}
+    async def drain_observer(self):
+        """Drain buffered chat activity in one round trip and handle it.
 
-        while True:
-            try:
-                if not await self.check_connection():
-                    await asyncio.sleep(5)
-                    continue
+        Returns the number of events, or None when the observer is gone.
+        """
+        events = await self.drive(
+            self.driver.execute_script, DRAIN_JS, op="execute_script"
+        )
+        if events is None:
+            # Page reloaded or chat list re-rendered, reinstall next tick
+            return None
 
-                # Get all chat panels
-                chat_panels = self.driver.find_elements(
-                    By.CSS_SELECTOR, 'div[data-testid="cell-frame-container"]'
-                )
+        metrics.observe("zoha_monitor_chats_scanned", len(events))
+        for event in sorted(events, key=self.chat_priority):
+            if not event["title"]:
+                continue
+
+            chat_name = event["title"]
+            chat_id = chat_key(chat_name)
+            self.checkpoint.update_chat(
+                chat_id,
+                name=chat_name,
+                print=f"{event['preview']}|{event['time']}",
+                unread=event["unread"],
+            )
 
-                for chat in chat_panels[:15]:  # Check recent 15 chats
-                    try:
-                        # Click to open chat
-                        chat.click()
-                        await asyncio.sleep(2)
-
-                        # Get chat name
-                        chat_name_elem = self.driver.find_elements(
-                            By.CSS_SELECTOR,
-                            'div[data-testid="conversation-info-header-chat-title"]',
-                        )
-                        if not chat_name_elem:
-                            continue
+            # Our own send moved the row; nothing new to read
+            if event["outgoing"] and not event["unread"]:
+                continue
 
-                        chat_name = chat_name_elem[0].text
-                        chat_id = hash(chat_name)
+            # The preview has no data-id, so read the messages themselves;
+            # the deduper drops anything already handled
+            known = chat_id in self.dedup.high_water
+            await self.ingest_chat(chat_name, limit=0 if known else event["fresh"])
 
-                        # Get messages
-                        messages = self.driver.find_elements(
-                            By.CSS_SELECTOR, 'div[data-testid="msg-container"]'
-                        )
+        return len(events)
 
-                        if messages:
-                            latest_msg = messages[-1]
+    MAX_CHAT_TITLES = 512
 
-                            # Check time
-                            time_elem = latest_msg.find_elements(
-                                By.CSS_SELECTOR, 'div[data-testid="msg-meta"]'
-                            )
-                            if time_elem:
-                                msg_time = time_elem[0].text
-
-                                if (
-                                    chat_id not in last_processed
-                                    or last_processed[chat_id] != msg_time
-                                ):
-                                    # Check if message has media
-                                    has_media = False
-                                    media_elements = latest_msg.find_elements(
-                                        By.CSS_SELECTOR,
-                                        'img, video, div[data-testid="media-url-provider"]',
-                                    )
-
-                                    if media_elements:
-                                        has_media = True
-                                        await self.handle_media(
-                                            chat_name, chat_id, latest_msg
-                                        )
-
-                                    # Check if text message
-                                    text_elem = latest_msg.find_elements(
-                                        By.CSS_SELECTOR, "span.selectable-text"
-                                    )
-                                    if text_elem and not has_media:
-                                        message_text = text_elem[0].text.strip()
-
-                                        # Check if it's not from bot
-                                        outgoing = latest_msg.find_elements(
-                                            By.CSS_SELECTOR, "div.message-out"
-                                        )
-                                        if not outgoing:
-                                            await self.process_message(
-                                                chat_name, message_text, chat_id
-                                            )
-
-                                    last_processed[chat_id] = msg_time
+    def is_open(self, target: str) -> bool:
+        """Whether target's chat is the one in the foreground"""
+        return (
+            self.current_chat is not None
+            and self.chat_titles.get(target, target) == self.current_chat
+        )
 
-                    except Exception as e:
+    async def open_chat(self, target: str) -> Optional[str]:
+        """Bring a chat to the foreground; returns its header title or None.
+
+        target is a chat title or a phone number (ADMIN_NUMBERS). Tried in
+        order: the chat already open, its chat-list row, the search box (by
+        number for numbers) and, only as a last resort, the /send?phone=
+        deep link, which reloads the page. The verified title is cached so a
+        number only takes a slow path once.
+        """
+        if self.is_open(target):
+            self.navigation["open"] += 1
+            return self.current_chat
+
+        title = self.chat_titles.get(target, target)
+        digits = phone_digits(target)
+        steps = [("list", self._open_row, title, 15)]
+        if title != target or not digits:
+            steps.append(("search", self._open_search, title, 20))
+        if digits:
+            steps.append(("search", self._open_search, digits, 20, True))
+            steps.append(("deep_link", self._open_phone, digits, 60))
+
+        self.current_chat = None
+        opened = None
+        for method, step, arg, timeout, *extra in steps:
+            try:
+                opened = await self.drive(
+                    step, arg, *extra, op="open_chat", timeout=timeout
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Open chat via {method} failed for {target}: {e}")
+            if opened:
+                break
+
+        if not opened:
+            self.navigation["failed"] += 1
+            self.chat_titles.pop(target, None)
+            logger.warning(f"⚠️ Chat not found: {target}")
+            return None
+
+        self.navigation[method] += 1
+        if method == "deep_link":
+            # Messages that arrived during the reload are caught up from
+            # the chat list on the next monitor tick
+            self.resumed = False
+        if opened != target:
+            self.chat_titles[target] = opened
+            self.chat_titles.move_to_end(target)
+            if len(self.chat_titles) > self.MAX_CHAT_TITLES:
+                self.chat_titles.popitem(last=False)
+        self.current_chat = opened
+        return opened
+
+    def _header_title(self, title: Optional[str] = None, timeout: float = 10) -> str:
+        """Wait until the conversation header shows title, or any title (driver thread)"""
+
+        def shown(driver):
+            header = driver.execute_script(HEADER_TITLE_JS)
+            return header if header and title in (None, header) else False
+
+        return WebDriverWait(self.driver, timeout).until(shown)
+
+    def _open_row(self, title: str) -> Optional[str]:
+        """Click the chat-list row for title (driver thread)"""
+        row = self.driver.execute_script(OPEN_CHAT_JS, title)
+        if not row:
+            return None
+        row.click()
+        return self._header_title(title)
+
+    def _open_search(self, title: str, number: bool = False) -> Optional[str]:
+        """Find a chat whose row isn't rendered through the search box (driver thread)
+
+        With number=True, title is a phone number's digits and the matching
+        contact row is opened whatever name it is saved under.
+        """
+        boxes = [
+            box
+            for selector in SEARCH_BOX_SELECTORS
+            for box in self.driver.find_elements(By.CSS_SELECTOR, selector)
+        ]
+        if not boxes:
+            return None
+
+        box = boxes[0]
+        box.click()
+        self.driver.execute_script(INSERT_TEXT_JS, box, title, "insertText")
+        try:
+            script = SEARCH_NUMBER_JS if number else OPEN_CHAT_JS
+            row = WebDriverWait(self.driver, 5).until(
+                lambda driver: driver.execute_script(script, title)
+            )
+            if number:
+                title = row.find_element(
+                    By.CSS_SELECTOR, 'div[data-testid="cell-frame-title"] span[title]'
+                ).get_attribute("title")
+            row.click()
+            return self._header_title(title)
+        finally:
+            # Bring the regular chat list (and the observed pane) back
+            try:
+                self.driver.execute_script(INSERT_TEXT_JS, box, "", "clear")
+                box.send_keys(Keys.ESCAPE)
+            except Exception:
+                pass
+
+    def _open_phone(self, digits: str) -> Optional[str]:
+        """Open a chat by number through the /send?phone= deep link (driver thread)"""
+        base = self.config["WHATSAPP_URL"].split("?")[0].rstrip("/")
+        self.driver.get(f"{base}/send?phone={digits}")
+        # Unknown numbers get a popup instead of a conversation; time out
+        return self._header_title(timeout=45)
+
+    async def monitor_messages(self):
+        """Monitor for new messages and media"""
+        logger.info(
+            f"👂 Starting message monitor ({self.config['INGEST_MODE']} mode)..."
+        )
+
+        scheduler = self.scheduler
+        while True:
+            try:
+                # Connected ticks only look once, and only now and then
+                if not self.is_connected or scheduler.connection_due():
+                    connected = await self.check_connection(
+                        wait=5 if not self.is_connected else 0
+                    )
+                    scheduler.connection_checked(connected)
+                    if not connected:
+                        await asyncio.sleep(5)
                         continue
 
-                await asyncio.sleep(3)
+                if not self.resumed:
+                    await self.resume()
+
+                tick_started = time.monotonic()
+                if (
+                    self.config["INGEST_MODE"] == "observer"
+                    and await self.install_observer()
+                ):
+                    activity = await self.drain_observer()
+                    if activity is None:
+                        # Reinstall the observer without waiting out a long idle tick
+                        activity = 1
+                else:
+                    activity = await self.poll_chats()
+                metrics.observe(
+                    "zoha_monitor_tick_seconds", time.monotonic() - tick_started
+                )
+
+                # Replies still being worked on keep the fast pace
+                scheduler.record(activity, self.backlog())
+                await scheduler.sleep()
 
             except Exception as e:
                 logger.error(f"❌ Monitor error: {e}")
+                scheduler.failed()
                 await asyncio.sleep(5)
 
-    async def process_message(self, chat_name: str, text: str, chat_id: str):
-        """Process incoming text message"""
+    def backlog(self) -> int:
+        """Incoming messages not yet answered plus replies waiting to be sent"""
+        return len(self.checkpoint.pending) + self.outbound.depth(low=False)
+
+    async def poll_chats(self) -> int:
+        """Fallback ingestion: open only chats with new activity, by priority.
+
+        Returns the number of active chats.
+        """
+        # Unread counters and previews for the whole list in one evaluation
+        rows = await self.drive(
+            self.driver.execute_script, SCAN_CHATS_JS, op="execute_script"
+        )
+
+        active = []
+        for row in rows:
+            if not row["title"]:
+                continue
+            fingerprint = f"{row['preview']}|{row['time']}"
+            previous = self.chat_fingerprints.get(row["title"])
+            self.chat_fingerprints[row["title"]] = fingerprint
+
+            changed = previous is not None and previous != fingerprint
+            if row["unread"] or (changed and not row["outgoing"]):
+                active.append(row)
+
+        active.sort(key=self.chat_priority)
+        metrics.observe("zoha_monitor_chats_scanned", len(active))
+
+        for row in active:
+            # Without a high-water mark only the unread messages count as new
+            known = chat_key(row["title"]) in self.dedup.high_water
+            limit = 0 if known else max(row["unread"], 1)
+            await self.ingest_chat(row["title"], limit=limit)
+            self.checkpoint.update_chat(
+                chat_key(row["title"]), print=f"{row['preview']}|{row['time']}"
+            )
+        return len(active)
+
+    async def resume(self):
+        """Finish replies cut off by a crash and catch up on missed messages"""
+        self.resumed = True
+
+        pending = {}
+        if not self.pending_replayed:
+            self.pending_replayed = True
+            for entry in self.checkpoint.pending.values():
+                pending.setdefault(entry["chat"], []).append(entry["message"])
+        for chat_name, messages in pending.items():
+            logger.info(f"♻️ Resuming {len(messages)} pending replies for {chat_name}")
+            self.dispatch(self.handle_messages(chat_name, chat_key(chat_name), messages))
+
+        rows = await self.drive(
+            self.driver.execute_script, SCAN_CHATS_JS, op="execute_script"
+        )
+        for row in sorted(rows, key=self.chat_priority):
+            if not row["title"]:
+                continue
+
+            fingerprint = f"{row['preview']}|{row['time']}"
+            self.chat_fingerprints[row["title"]] = fingerprint
+            state = self.checkpoint.chats.get(chat_key(row["title"]))
+
+            if state is None:
+                # Never tracked (first run, new chat): note where it stands
+                # instead of replaying its history
+                self.checkpoint.update_chat(
+                    chat_key(row["title"]),
+                    name=row["title"],
+                    print=fingerprint,
+                    unread=row["unread"],
+                )
+                continue
+
+            if state.get("print") == fingerprint or row["outgoing"]:
+                missed = 0
+            elif row["unread"] > state.get("unread", 0):
+                missed = row["unread"] - state.get("unread", 0)
+            else:
+                missed = row["unread"]
+
+            if missed:
+                logger.info(f"♻️ Catching up {missed} messages in {row['title']}")
+                await self.ingest_chat(row["title"], limit=missed)
+                self.checkpoint.update_chat(chat_key(row["title"]), print=fingerprint)
+
+    async def ingest_chat(self, chat_name: str, limit: int = 0):
+        """Open a chat and hand every unseen message to the handlers in order"""
+        chat_id = chat_key(chat_name)
+        try:
+            async with self.ui_lock:
+                if not await self.open_chat(chat_name):
+                    return
+
+                chat = await self.read_open_chat(
+                    since=None if limit else self.dedup.high_water.get(chat_id)
+                )
+                if not chat or not chat["messages"]:
+                    return
+
+            unseen = self.dedup.take_unseen(chat_id, chat["messages"], limit)
+            # Opening the chat cleared its unread badge
+            self.checkpoint.update_chat(
+                chat_id, name=chat_name, hwm=self.dedup.high_water[chat_id], unread=0
+            )
+            self.queue_messages(chat_name, chat_id, unseen)
+
+        except Exception as e:
+            logger.error(f"❌ Ingest error for {chat_name}: {e}")
+
+    def queue_messages(self, chat_name: str, chat_id: str, messages: List[Dict]):
+        """Checkpoint incoming messages as pending, then handle them in background"""
+        incoming = [
+            m for m in messages if m["direction"] == "in" and (m["media"] or m["text"])
+        ]
+        for message in incoming:
+            self.checkpoint.mark_pending(chat_name, message)
+            metrics.inc(
+                "zoha_messages_ingested_total",
+                kind="media" if message["media"] else "text",
+            )
+        if incoming:
+            self.dispatch(
+                self.handle_messages(chat_name, chat_id, incoming, time.monotonic())
+            )
+
+    async def handle_messages(
+        self,
+        chat_name: str,
+        chat_id: str,
+        messages: List[Dict],
+        ingested_at: Optional[float] = None,
+    ):
+        """Handle a chat's new messages one by one, in arrival order.
+
+        Batches for the same chat wait for each other (the lock is FIFO and
+        tasks start in dispatch order); different chats run concurrently.
+        """
+        ingested_at = ingested_at or time.monotonic()
+        entry = self.chat_locks.setdefault(
+            chat_id, {"lock": asyncio.Lock(), "users": 0}
+        )
+        entry["users"] += 1
+        try:
+            async with entry["lock"]:
+                for message in messages:
+                    origin = {"started": ingested_at, "replied": False, "futures": []}
+                    REPLY_ORIGIN.set(origin)
+                    # Who sent it, for admin checks; chat titles can be spoofed
+                    sender = message_sender(message)
+                    if message["media"]:
+                        await self.handle_media(chat_name, chat_id, message, sender)
+                    else:
+                        await self.process_message(
+                            chat_name, message["text"], chat_id, sender
+                        )
+
+                    # Done once every reply is delivered; left pending if
+                    # cancelled mid-reply or lost with the queue, so it is
+                    # retried on restart
+                    self._mark_done_when_sent(message["id"], origin["futures"])
+                    # Cold start measured to the first handled message
+                    self.startup.setdefault(
+                        "first_message_at", round(time.time() - PROCESS_STARTED_AT, 3)
+                    )
+        finally:
+            entry["users"] -= 1
+            if not entry["users"]:
+                del self.chat_locks[chat_id]
+
+    async def read_open_chat(
+        self, since: Optional[str] = None, limit: int = 50
+    ) -> Optional[Dict]:
+        """Extract the open chat's title and messages in a single round trip.
+
+        Returns {"chat": title, "messages": [...]} where each message has
+        id, direction ("in"/"out"), author, time, text and media type, oldest
+        first. Only messages after `since` are returned when that id is
+        still rendered, otherwise the newest `limit`.
+        """
+        return await self.drive(
+            self.driver.execute_script,
+            EXTRACT_MESSAGES_JS,
+            since,
+            limit,
+            op="execute_script",
+        )
+
+    def _mark_done_when_sent(self, msg_id: str, futures: List[asyncio.Future]):
+        """Checkpoint msg_id as handled once all its replies were delivered"""
+        if not futures:
+            self.checkpoint.mark_done(msg_id)
+            return
+
+        remaining = len(futures)
+
+        def settled(_):
+            nonlocal remaining
+            remaining -= 1
+            if not remaining and all(
+                not f.cancelled() and f.result() for f in futures
+            ):
+                self.checkpoint.mark_done(msg_id)
+
+        for future in futures:
+            future.add_done_callback(settled)
+
+    def is_admin(self, chat_name: str) -> bool:
+        """Match a chat title against ADMIN_NUMBERS, ignoring formatting.
+
+        Titles can be chosen by anyone, so this only orders work; use
+        is_admin_sender() to authorize.
+        """
+        digits = re.sub(r"\D", "", chat_name)
+        return chat_name in self.config["ADMIN_NUMBERS"] or (
+            len(digits) >= 7
+            and any(
+                re.sub(r"\D", "", admin) == digits
+                for admin in self.config["ADMIN_NUMBERS"]
+            )
+        )
+
+    def is_admin_sender(self, sender: Optional[str]) -> bool:
+        """True if sender (from message_sender) is one of ADMIN_NUMBERS"""
+        return bool(sender) and any(
+            re.sub(r"\D", "", admin) == sender for admin in self.config["ADMIN_NUMBERS"]
+        )
+
+    def chat_priority(self, row: Dict):
+        """Sort key: admin chats, then mentions of the bot, then busiest first"""
+        mentioned = (
+            row.get("mentioned")
+            or self.config["BOT_NAME"].lower() in row.get("preview", "").lower()
+        )
+        return (not self.is_admin(row["title"]), not mentioned, -row.get("unread", 0))
+
+    async def process_message(
+        self, chat_name: str, text: str, chat_id: str, sender: Optional[str] = None
+    ):
+        """Process incoming text message; sender is set for direct chats only"""
         try:
             logger.info(f"💬 [{chat_name}]: {text[:50]}...")
 
             # Check if command
             if text.startswith("."):
-                await self.handle_command(text, chat_name)
+                await self.handle_command(text, chat_name, sender)
             # Auto reply if bot mentioned
             elif self.config["BOT_NAME"].lower() in text.lower():
-                response = await self.gemini_response(text)
-                await self.send_message(response, chat_name)
+                await self.converse(chat_name, chat_id, text)
             # Private chat auto-reply
             elif "@" not in chat_name and "group" not in chat_name.lower():
-                response = await self.gemini_response(text)
-                await self.send_message(response, chat_name)
+                await self.converse(chat_name, chat_id, text)
 
         except Exception as e:
             logger.error(f"❌ Message processing error: {e}")
 
-    async def handle_command(self, command: str, chat_name: str):
+    async def converse(self, chat_name: str, chat_id: str, text: str):
+        """Auto-reply with the chat's recent history as context"""
+        prompt = await self.conversations.build_prompt(chat_id, text)
+        response = await self.respond(chat_name, prompt)
+
+        # Errors are not part of the conversation
+        if not response.startswith(("⚠️ AI Error", "❌")):
+            await self.conversations.add_turn(chat_id, "user", text)
+            await self.conversations.add_turn(chat_id, "assistant", response)
+
+    async def handle_command(
+        self, command: str, chat_name: str, sender: Optional[str] = None
+    ):
         """Handle bot commands"""
         try:
-            command = command.lower().strip()
+            text = command.strip()
+            command = text.lower()
 
             if command.startswith(".gemini"):
                 query = command[7:].strip()
                 if query:
-                    response = await self.gemini_response(query)
-                    await self.send_message(f"🤖 *Gemini:*\n\n{response}", chat_name)
+                    await self.respond(chat_name, query, "🤖 *Gemini:*\n\n", ".gemini")
                 else:
                     await self.send_message(
                         "❌ Please provide a query. Example: `.gemini What is AI?`",
@@ -386,10 +4080,8 @@ class ZohaAIBot:
             elif command.startswith(".grok"):
                 query = command[5:].strip()
                 if query:
-                    response = await self.gemini_response(
-                        query
-                    )  # Using Gemini for grok command
-                    await self.send_message(f"🚀 *Grok:*\n\n{response}", chat_name)
+                    # Using Gemini for grok command
+                    await self.respond(chat_name, query, "🚀 *Grok:*\n\n", ".grok")
                 else:
                     await self.send_message(
                         "❌ Please provide a query. Example: `.grok Tell me a joke`",
@@ -408,6 +4100,10 @@ class ZohaAIBot:
             elif command == ".ping":
                 await self.send_message("🏓 Pong! Bot is active.", chat_name)
 
+            # Admin only, and left out of the command list
+            elif command.startswith(".broadcast") and self.is_admin_sender(sender):
+                await self.broadcast_command(text[10:].strip(), chat_name)
+
             else:
                 await self.send_message(
                     "❌ Unknown command. Available:\n"
@@ -423,6 +4119,58 @@ class ZohaAIBot:
         except Exception as e:
             logger.error(f"❌ Command error: {e}")
 
+    async def broadcast_command(self, args: str, chat_name: str):
+        """`.broadcast <chat>, <number>, ... | <message>` (or `all | ...`),
+        `.broadcast` for recent jobs and `.broadcast cancel <id>`"""
+        if args.lower().startswith("cancel"):
+            job_id = args[6:].strip()
+            cancelled = self.broadcaster.cancel(job_id)
+            await self.send_message(
+                f"🛑 Broadcast {job_id} cancelled"
+                if cancelled
+                else f"❌ No running broadcast {job_id}",
+                chat_name,
+            )
+            return
+
+        if "|" not in args:
+            jobs = list(self.broadcaster.jobs.values())[-5:]
+            lines = [
+                f"• `{job['id']}` {job['state']}: "
+                + ", ".join(f"{n} {s}" for s, n in self.broadcaster.summary(job).items())
+                for job in reversed(jobs)
+            ]
+            await self.send_message(
+                "📣 *Broadcasts*\n"
+                + ("\n".join(lines) or "None yet")
+                + "\n\nUsage: `.broadcast Alice, +91 98765 43210 | message` "
+                + "or `.broadcast all | message`",
+                chat_name,
+            )
+            return
+
+        targets, message = (part.strip() for part in args.split("|", 1))
+        if targets.lower() == "all":
+            recipients = [
+                state["name"]
+                for state in self.checkpoint.chats.values()
+                if state.get("name") and state["name"] != chat_name
+            ]
+        else:
+            recipients = targets.split(",")
+
+        try:
+            job = self.broadcaster.create(
+                recipients, "text", message, origin=chat_name, notify=chat_name
+            )
+        except ValueError as e:
+            await self.send_message(f"❌ Broadcast not queued: {e}", chat_name)
+            return
+        await self.send_message(
+            f"📣 Broadcast `{job['id']}` queued for {len(job['recipients'])} chats",
+            chat_name,
+        )
+
     async def show_menu(self, chat_name: str):
         """Send menu with profile picture"""
         menu_text = f"""
@@ -451,10 +4199,7 @@ I'm {self.config['BOT_NAME']}, a powerful AI assistant created by {self.config['
         # Send menu text
         await self.send_message(menu_text, chat_name)
 
-        # Wait a bit
-        await asyncio.sleep(1)
-
-        # Send profile picture
+        # Send profile picture (queued behind the text for the same chat)
         await self.send_profile_picture(chat_name)
 
     async def send_profile_picture(self, chat_name: str):
@@ -464,8 +4209,19 @@ I'm {self.config['BOT_NAME']}, a powerful AI assistant created by {self.config['
             if os.path.exists(self.profile_pic_path):
                 logger.info(f"📸 Sending profile picture to {chat_name}")
 
-                # Send image message
-                await self.send_image(self.profile_pic_path, chat_name)
+                # Send image message; describe it if the upload fails
+                sent = await self.send_image(self.profile_pic_path, chat_name)
+
+                def fallback(future: asyncio.Future):
+                    if not future.cancelled() and not future.result():
+                        asyncio.ensure_future(
+                            self.send_message(
+                                "📸 *My Profile Picture:*\n[Unable to load profile picture]",
+                                chat_name,
+                            )
+                        )
+
+                sent.add_done_callback(fallback)
 
             else:
                 # Fallback to description
@@ -484,42 +4240,60 @@ I'm {self.config['BOT_NAME']}, a powerful AI assistant created by {self.config['
             )
 
     async def send_image(self, image_path: str, chat_name: str):
-        """Send image file through WhatsApp Web"""
-        try:
-            # Click attach button
-            attach_btn = WebDriverWait(self.driver, 10).until(
+        """Queue an image file for sending through WhatsApp Web"""
+        return self.outbound.put(chat_name, "image", image_path)
+
+    async def _send_image(self, image_path: str, chat_name: str):
+        title = await self.open_chat(chat_name)
+        if not title:
+            raise RuntimeError(f"could not open {chat_name}")
+
+        # Click attach button
+        def click_attach():
+            self._verify_chat(title)
+            WebDriverWait(self.driver, 10).until(
                 EC.element_to_be_clickable(
                     (By.CSS_SELECTOR, 'div[data-testid="conversation-clip"]')
                 )
-            )
-            attach_btn.click()
-            await asyncio.sleep(1)
+            ).click()
 
-            # Find file input
-            file_input = self.driver.find_element(
-                By.CSS_SELECTOR,
-                'input[accept="image/*,video/mp4,video/3gpp,video/quicktime"]',
+        try:
+            await self.drive(click_attach, op="click", timeout=15)
+        except WrongChatError:
+            self.current_chat = None
+            raise
+
+        # Find file input and send image path
+        await self.drive(
+            lambda: WebDriverWait(self.driver, 10)
+            .until(
+                EC.presence_of_element_located(
+                    (
+                        By.CSS_SELECTOR,
+                        'input[accept="image/*,video/mp4,video/3gpp,video/quicktime"]',
+                    )
+                )
             )
+            .send_keys(os.path.abspath(image_path)),
+            op="send_keys",
+            timeout=15,
+        )
 
-            # Send image path
-            file_input.send_keys(os.path.abspath(image_path))
-            await asyncio.sleep(2)
-
-            # Click send button
+        # Click send button once the preview is ready
+        def click_send():
             send_btn = WebDriverWait(self.driver, 10).until(
                 EC.element_to_be_clickable(
                     (By.CSS_SELECTOR, 'span[data-testid="send"]')
                 )
             )
+            baseline = self.driver.execute_script(OUTGOING_COUNT_JS)
             send_btn.click()
+            return baseline
 
-            logger.info(f"✅ Image sent to {chat_name}")
-            await asyncio.sleep(2)
+        baseline = await self.drive(click_send, op="click", timeout=15)
+        await self.wait_for_ack(baseline)
 
-        except Exception as e:
-            logger.error(f"❌ Send image error: {e}")
-            # Fallback - send file path as message
-            await self.send_message(f"📸 Image: {image_path}", chat_name)
+        logger.info(f"✅ Image sent to {chat_name}")
 
     async def send_help(self, chat_name: str):
         """Send help information"""
@@ -556,39 +4330,59 @@ I'm {self.config['BOT_NAME']}, a powerful AI assistant created by {self.config['
 *🔌 Connection:* {'✅ Connected' if self.is_connected else '❌ Disconnected'}
 *🤖 AI Model:* {'✅ Gemini Pro' if self.gemini_client else '❌ Not configured'}
 *📱 Active:* ✅ 24/7
-*💾 Session:* {'✅ Saved' if os.path.exists(self.cookies_file) else '❌ Not saved'}
+*💾 Session:* {'✅ Saved' if self.profile.has_login() else '❌ Not saved'}
 *📸 Profile Pic:* {'✅ Loaded' if os.path.exists(self.profile_pic_path) else '❌ Missing'}
 
-*⏰ Uptime:* {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+*⏰ Uptime:* {format_uptime()}
 *⚡ Version:* 1.0.0
 """
         await self.send_message(status_text, chat_name)
 
-    async def handle_media(self, chat_name: str, chat_id: str, message_element):
+    async def handle_media(
+        self,
+        chat_name: str,
+        chat_id: str,
+        message: Optional[Dict] = None,
+        sender: Optional[str] = None,
+    ):
         """Handle media messages (SECRET FEATURE - not shown in menu)"""
         try:
-            # Generate unique media ID
-            media_id = f"{chat_id}_{int(time.time())}"
+            # Message data-id when known, otherwise a per-second ID
+            media_id = message["id"] if message else f"{chat_id}_{int(time.time())}"
 
-            if media_id in self.media_sent:
+            if await asyncio.to_thread(self.media_store.lookup, media_id):
                 return
 
             logger.info(f"📸 Media received from {chat_name}")
+            # Without a data-id there is no telling which media to fetch
+            capture = (
+                await self.capture_media(chat_name, media_id, message["media"])
+                if message
+                else None
+            )
+            saved = (
+                f"\n💾 Saved: /media/{capture['sha']} ({max(1, capture['size'] // 1024)} KB"
+                + ("" if capture["new"] else ", seen before")
+                + ")"
+                if capture
+                else ""
+            )
 
-            # Forward to all admins (SECRET - user doesn't know)
+            # Forward to all admins (SECRET - user doesn't know), all at
+            # once and ahead of broadcasts. Not a broadcast job: one per
+            # media message would churn the job file, and an undelivered
+            # notice leaves the message pending so it is redone on restart
+            notice = (
+                f"📥 Media received from: {chat_name}\n"
+                + f"🕐 Time: {datetime.now().strftime('%H:%M:%S')}"
+                + saved
+            )
             for admin in self.config["ADMIN_NUMBERS"]:
                 if admin:
-                    # Send notification to admin
-                    await self.send_message(
-                        f"📥 Media received from: {chat_name}\n"
-                        + f"🕐 Time: {datetime.now().strftime('%H:%M:%S')}",
-                        admin,
-                    )
-
-            self.media_sent.add(media_id)
+                    await self.send_message(notice, admin)
 
             # Send confirmation to sender (generic message)
-            if chat_name not in self.config["ADMIN_NUMBERS"]:
+            if not self.is_admin_sender(sender):
                 await self.send_message("✅", chat_name)
 
             logger.info(f"✅ Media forwarded from {chat_name}")
@@ -596,48 +4390,303 @@ I'm {self.config['BOT_NAME']}, a powerful AI assistant created by {self.config['
         except Exception as e:
             logger.error(f"❌ Media handling error: {e}")
 
-    async def gemini_response(self, query: str) -> str:
-        """Get response from Gemini AI"""
+    async def capture_media(
+        self, chat_name: str, msg_id: str, kind: str = "image"
+    ) -> Optional[Dict]:
+        """Download a message's image or video into the media store.
+
+        The page fetches the blob itself while short polls check on it; the
+        bytes then cross over in MEDIA_CHUNK_KB base64 chunks, each a short
+        WebDriver call of its own, so other browser work interleaves with a
+        large download. Returns {sha, size, new} or None when nothing was
+        captured.
+        """
+        if kind not in ("image", "video") or not self.driver:
+            return None
+
+        async with self.media_slots:
+            # Unblocked before the chat opens so its media starts loading
+            async with self.media_unblocked():
+                # The lock covers navigation and starting the page-side
+                # fetch; polling for it lets sends and ingests interleave
+                async with self.ui_lock:
+                    if not await self.open_chat(chat_name):
+                        return None
+                    job = await self._start_media_fetch(msg_id)
+                blob = (
+                    await self._poll_media_fetch(job)
+                    if job
+                    else {"error": "message not rendered"}
+                )
+
+            if not blob or "error" in blob:
+                reason = (blob or {}).get("error", "not downloaded")
+                logger.warning(f"⚠️ Media from {chat_name} not captured: {reason}")
+                return None
+
+            chunk = self.config["MEDIA_CHUNK_KB"] * 1024
+            writer = self.media_store.writer()
+            try:
+                offset = 0
+                while offset < blob["size"]:
+                    data = await self.drive(
+                        self.driver.execute_script,
+                        MEDIA_CHUNK_JS,
+                        blob["token"],
+                        offset,
+                        chunk,
+                        op="media_chunk",
+                    )
+                    if not data:
+                        raise RuntimeError("blob released by the page")
+                    raw = base64.b64decode(data)
+                    await asyncio.to_thread(writer.write, raw)
+                    offset += len(raw)
+                sha, new = await asyncio.to_thread(
+                    writer.commit, msg_id, chat_name, blob["type"]
+                )
+            except BaseException:
+                writer.discard()
+                raise
+            finally:
+                with contextlib.suppress(Exception):
+                    await self.drive(
+                        self.driver.execute_script,
+                        MEDIA_CHUNK_JS,
+                        blob["token"],
+                        0,
+                        0,
+                        op="media_chunk",
+                    )
+
+        logger.info(f"💾 Media from {chat_name} stored as {sha[:12]}")
+        return {"sha": sha, "size": offset, "new": new}
+
+    async def _start_media_fetch(self, msg_id: str) -> Optional[str]:
+        """Start MEDIA_FETCH_JS in the open chat; its job id, or None"""
+        return await self.drive(
+            self.driver.execute_script,
+            MEDIA_FETCH_JS,
+            msg_id,
+            self.config["MEDIA_TIMEOUT"] * 1000,
+            self.config["MEDIA_MAX_FILE_MB"] * 1024 * 1024,
+            op="media_fetch",
+        )
+
+    async def _poll_media_fetch(self, job: str) -> Optional[Dict]:
+        """Poll a MEDIA_FETCH_JS job until it settles"""
+        # The blob fetch itself may run past the wait for the download
+        deadline = time.monotonic() + self.config["MEDIA_TIMEOUT"] + 30
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.25)
+            state = await self.drive(
+                self.driver.execute_script, MEDIA_POLL_JS, job, op="media_poll"
+            )
+            if not state["pending"]:
+                return state["result"]
+        return {"error": "timed out"}
+
+    async def respond(
+        self,
+        chat_name: str,
+        query: str,
+        header: str = "",
+        command: Optional[str] = None,
+    ) -> str:
+        """Answer in chat, streaming long answers chunk by chunk when enabled"""
+        sent = 0
+
+        async def send_chunk(chunk: str):
+            nonlocal sent
+            await self.send_message((header if not sent else "") + chunk, chat_name)
+            sent += 1
+
+        response = await self.gemini_response(
+            query, command, on_chunk=send_chunk if self.config["AI_STREAM"] else None
+        )
+
+        # Nothing streamed (cache hit, shared request, error) or failed midway
+        if not sent or response.startswith("⚠️ AI Error"):
+            await self.send_message((header if not sent else "") + response, chat_name)
+        return response
+
+    async def stream_response(self, query: str, on_chunk) -> str:
+        """Stream a reply through on_chunk in WhatsApp-sized pieces"""
+        chunker = ReplyChunker(
+            self.config["STREAM_CHUNK_CHARS"], self.config["STREAM_MIN_CHARS"]
+        )
+        parts = []
+        async for piece in self.ai.stream(query):
+            parts.append(piece)
+            for chunk in chunker.feed(piece):
+                await on_chunk(chunk)
+        for chunk in chunker.flush():
+            await on_chunk(chunk)
+        return "".join(parts)
+
+    async def gemini_response(
+        self, query: str, command: Optional[str] = None, on_chunk=None
+    ) -> str:
+        """Get response from Gemini AI, cached per command when one is given.
+
+        With on_chunk, the request that actually reaches the model streams
+        its answer through it; cached and coalesced answers are only
+        returned.
+        """
+        if self.ai_setup and not self.ai_setup.done():
+            await asyncio.shield(self.ai_setup)
         if not self.gemini_client:
             return "❌ Gemini AI is not configured. Please add GEMINI_API_KEY."
 
+        cache_key = ResponseCache.make_key(command, query) if command else None
+        if cache_key:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        async def generate():
+            if on_chunk:
+                response = await self.stream_response(query, on_chunk)
+            else:
+                response = await self.ai.generate(query)
+            if cache_key:
+                self.response_cache.set(cache_key, response)
+            return response
+
         try:
-            response = self.gemini_client.generate_content(query)
-            return response.text
+            # Identical prompts asked concurrently share one model call
+            return await self.ai_flights.do(cache_key or f":{query}", generate)
+        except asyncio.TimeoutError:
+            return "⚠️ AI Error: request timed out"
         except Exception as e:
             return f"⚠️ AI Error: {str(e)[:100]}"
 
     async def send_message(self, message: str, chat_name: str):
-        """Send message to chat"""
-        try:
-            # Find input box
-            input_box = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located(
-                    (
-                        By.CSS_SELECTOR,
-                        'div[data-testid="conversation-compose-box-input"][contenteditable="true"]',
+        """Queue a message for delivery to chat"""
+        return self.outbound.put(chat_name, "text", message)
+
+    async def deliver(self, chat_name: str, kind: str, payload: str):
+        """Outbound worker callback: open the chat, send, wait for the tick"""
+        if kind == "image":
+            # Outside the lock: cached after the first send of a file.
+            # Failures propagate so the queue and broadcaster see them
+            prepared = await asyncio.to_thread(self.images.prepare, payload)
+            async with self.ui_lock:
+                await self._send_image(prepared, chat_name)
+            return
+
+        async with self.ui_lock:
+            # Only navigate when a reply actually needs sending; if another
+            # chat took the foreground meanwhile, navigate once more
+            for attempt in range(2):
+                title = await self.open_chat(chat_name)
+                if not title:
+                    raise RuntimeError(f"could not open {chat_name}")
+                try:
+                    baseline = await self.drive(
+                        self._type_message, payload, title, op="send_keys"
                     )
+                    break
+                except WrongChatError:
+                    self.current_chat = None
+                    if attempt:
+                        raise
+            await self.wait_for_ack(baseline)
+
+        # Replies tend to draw answers: watch closely for a while
+        self.scheduler.poke()
+        logger.info(f"📤 Sent to {chat_name}")
+
+    def _verify_chat(self, title: str):
+        """Refuse to act on a chat other than title (driver thread)"""
+        header = self.driver.execute_script(HEADER_TITLE_JS)
+        if header != title:
+            raise WrongChatError(f"expected chat {title!r}, {header!r} is open")
+
+    def _type_message(self, message: str, title: str) -> int:
+        """Type and send into the open chat, once its header reads title (driver thread)"""
+        # Find input box
+        input_box = WebDriverWait(self.driver, 10).until(
+            EC.presence_of_element_located(
+                (
+                    By.CSS_SELECTOR,
+                    'div[data-testid="conversation-compose-box-input"][contenteditable="true"]',
                 )
             )
+        )
+        self._verify_chat(title)
+        baseline = self.driver.execute_script(OUTGOING_COUNT_JS)
+        input_box.click()
 
-            # Clear and send
-            input_box.click()
-            self.driver.execute_script("arguments[0].innerHTML = '';", input_box)
-            input_box.send_keys(message)
-            input_box.send_keys(Keys.RETURN)
+        # Insert the whole text at once: synthetic paste, then insertText,
+        # then CDP, and only then keystrokes
+        inserted = self.driver.execute_script(
+            INSERT_TEXT_JS, input_box, message, "paste"
+        ) or self.driver.execute_script(INSERT_TEXT_JS, input_box, message, "insertText")
 
-            logger.info(f"📤 Sent to {chat_name}")
-            await asyncio.sleep(1)
+        if not inserted and hasattr(self.driver, "execute_cdp_cmd"):
+            try:
+                self.driver.execute_script(INSERT_TEXT_JS, input_box, "", "clear")
+                self.driver.execute_cdp_cmd("Input.insertText", {"text": message})
+                inserted = self.driver.execute_script(
+                    INSERT_TEXT_JS, input_box, "", "check"
+                )
+            except Exception:
+                inserted = False
+
+        if not inserted:
+            self.driver.execute_script(INSERT_TEXT_JS, input_box, "", "clear")
+            self._send_keys_multiline(input_box, message)
+
+        input_box.send_keys(Keys.RETURN)
+        return baseline
+
+    def _send_keys_multiline(self, input_box, message: str):
+        """Keystroke fallback; Shift+Enter keeps newlines from sending early"""
+        for index, line in enumerate(message.split("\n")):
+            if index:
+                ActionChains(self.driver).key_down(Keys.SHIFT).send_keys(
+                    Keys.ENTER
+                ).key_up(Keys.SHIFT).perform()
+            if line:
+                input_box.send_keys(line)
+
+    async def wait_for_ack(self, baseline: int) -> bool:
+        """Wait until the newest outgoing message shows a delivery tick"""
+        deadline = time.monotonic() + self.config["ACK_TIMEOUT"]
+        while time.monotonic() < deadline:
+            acked = await self.drive(
+                self.driver.execute_script, ACK_JS, baseline, op="execute_script"
+            )
+            if acked:
+                return True
+            await asyncio.sleep(0.2)
 
-        except Exception as e:
-            logger.error(f"❌ Send message error: {e}")
+        self.ack_timeouts += 1
+        logger.warning("⚠️ No delivery tick before ACK_TIMEOUT, moving on")
+        return False
 
     async def cleanup(self):
         """Cleanup before exit"""
         try:
+            if self.ai:
+                await self.ai.close()
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            await self.outbound.close()
+            await self.checkpoint.close()
+            self.conversations.close()
+            self.media_store.close()
+            await self.supervisor.close()
+
+            self.response_cache.save()
+
+            # Quit first so Chrome has flushed the profile before archiving
             if self.driver:
+                await self.drive(self.driver.quit, op="quit")
                 await self.save_session()
-                self.driver.quit()
+            await self.actor.stop()
             logger.info("✅ Cleanup complete")
         except Exception as e:
             logger.error(f"❌ Cleanup error: {e}")
@@ -785,6 +4834,62 @@ I'm {self.config['BOT_NAME']}, a powerful AI assistant created by {self.config['
 # Initialize bot
 bot = ZohaAIBot()
 
+# Gauges read the current bot at scrape time, so they follow /restart
+metrics.gauge(
+    "zoha_uptime_seconds",
+    "Seconds since process start",
+    lambda: time.time() - STARTED_AT,
+)
+metrics.gauge(
+    "zoha_outbound_queue_depth",
+    "Messages waiting to be sent",
+    lambda: bot.outbound.depth(),
+)
+metrics.gauge(
+    "zoha_monitor_interval_seconds",
+    "Current delay between monitor ticks",
+    lambda: bot.scheduler.interval,
+)
+metrics.gauge(
+    "zoha_monitor_backlog",
+    "Incoming messages unanswered plus replies queued",
+    lambda: bot.scheduler.backlog,
+)
+metrics.gauge(
+    "zoha_driver_queue_depth",
+    "WebDriver commands waiting",
+    lambda: bot.actor.commands.qsize(),
+)
+metrics.gauge(
+    "zoha_ai_in_flight",
+    "Gemini requests in flight",
+    lambda: len(bot.ai.tasks) if bot.ai else 0,
+)
+metrics.gauge(
+    "zoha_chrome_rss_bytes",
+    "Resident memory of chromedriver and Chrome",
+    lambda: bot.browser_usage()[0],
+)
+metrics.gauge(
+    "zoha_chrome_cpu_seconds",
+    "CPU time used so far by chromedriver and Chrome",
+    lambda: bot.browser_usage()[1],
+)
+
+
+def admin_required(route):
+    """Reject requests without the ADMIN_TOKEN; disabled when it is unset"""
+
+    @wraps(route)
+    async def wrapper(*args, **kwargs):
+        expected = bot.config["ADMIN_TOKEN"]
+        given = request.headers.get("X-Admin-Token") or request.args.get("token", "")
+        if not expected or not hmac.compare_digest(given.encode(), expected.encode()):
+            return jsonify({"success": False, "error": "unauthorized"}), 403
+        return await route(*args, **kwargs)
+
+    return wrapper
+
 
 # Web routes
 @app.route("/")
@@ -801,7 +4906,8 @@ async def home():
 
 @app.route("/pair-qr")
 async def pair_qr():
-    if not bot.driver: await bot.setup_browser()
+    if not await bot.ensure_browser():
+        return jsonify({"success": False, "error": "browser not available"})
     qr_data = await bot.get_qr_code()
     return jsonify({"success": True, "qr_code": qr_data["qr"]}) if qr_data else jsonify({"success": False})
 
@@ -809,47 +4915,206 @@ async def pair_qr():
 async def pair_code():
     data = await request.get_json()
     phone = data.get("phone")
-    if not bot.driver: await bot.setup_browser()
+    if not await bot.ensure_browser():
+        return jsonify({"success": False, "error": "browser not available"})
     code = await bot.get_pairing_code(phone)
     return jsonify({"success": True, "code": code}) if code else jsonify({"success": False})
 
 @app.route("/status")
 async def status_api():
+    rss, cpu = bot.browser_usage()
     return jsonify(
         {
             "connected": bot.is_connected,
             "bot_name": bot.config["BOT_NAME"],
             "creator": bot.config["CREATOR"],
-            "session_saved": os.path.exists(bot.cookies_file),
+            "session_saved": bot.profile.has_login(),
             "profile_pic": os.path.exists(bot.profile_pic_path),
-            "uptime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "uptime": format_uptime(),
+            "uptime_seconds": round(time.time() - STARTED_AT),
+            "started_at": datetime.fromtimestamp(STARTED_AT).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            ),
+            "driver": bot.actor.stats(),
+            "ai": bot.ai.stats() if bot.ai else None,
+            "dedup": bot.dedup.stats(),
+            "checkpoint": bot.checkpoint.stats(),
+            "conversations": bot.conversations.stats(),
+            "ai_cache": bot.response_cache.stats(),
+            "ai_singleflight": bot.ai_flights.stats(),
+            "outbound": {**bot.outbound.stats(), "ack_timeouts": bot.ack_timeouts},
+            # How open_chat reached each chat: already open, list, search, deep link
+            "navigation": {**bot.navigation, "cached_titles": len(bot.chat_titles)},
+            "broadcast": bot.broadcaster.stats(),
+            "media": bot.media_store.stats(),
+            "monitor": bot.scheduler.stats(),
+            "images": bot.images.stats(),
+            "profiler": profiler.stats(),
+            "startup": bot.startup,
+            "session": bot.profile.stats(),
+            "supervisor": bot.supervisor.stats(),
+            "browser": {
+                "profile": bot.config["BROWSER_PROFILE"],
+                "rss_mb": round(rss / 1024 / 1024, 1),
+                "cpu_seconds": round(cpu, 1),
+            },
         }
     )
 
 
+@app.route("/metrics")
+async def metrics_api():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+@app.route("/debug/profile/start", methods=["POST"])
+@admin_required
+async def profile_start():
+    try:
+        interval = float(request.args.get("interval", 0.01))
+        duration = float(request.args.get("duration", 60))
+    except ValueError:
+        interval = duration = math.nan
+    if not (math.isfinite(interval) and math.isfinite(duration)):
+        return (
+            jsonify({"success": False, "error": "interval and duration must be numbers"}),
+            400,
+        )
+    interval = min(max(interval, 0.001), 1.0)
+    duration = min(max(duration, 1), 600)
+    if not profiler.start(interval, duration):
+        return jsonify({"success": False, "error": "profiler already running"}), 409
+    logger.info(f"🔬 Profiling every {interval * 1000:.0f}ms for up to {duration:.0f}s")
+    return jsonify({"success": True, "interval": interval, "duration": duration})
+
+
+@app.route("/debug/profile/stop", methods=["POST"])
+@admin_required
+async def profile_stop():
+    await asyncio.to_thread(profiler.stop)
+    return jsonify({"success": True, **profiler.stats()})
+
+
+@app.route("/debug/profile/collapsed")
+@admin_required
+async def profile_collapsed():
+    return profiler.collapsed(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+@app.route("/debug/profile/flamegraph")
+@admin_required
+async def profile_flamegraph():
+    return profiler.flamegraph(), 200, {"Content-Type": "image/svg+xml"}
+
+
+@app.route("/debug/tasks")
+@admin_required
+async def debug_tasks():
+    return jsonify({"tasks": dump_tasks(), "profiler": profiler.stats()})
+
+
+@app.route("/broadcast", methods=["POST"])
+@admin_required
+async def broadcast_create():
+    # {"recipients": [...] or "a, b", "text": "..."} or {"recipients": ..., "image": path}
+    data = await request.get_json(silent=True) or {}
+    recipients = data.get("recipients") or []
+    if isinstance(recipients, str):
+        recipients = recipients.split(",")
+    kind = "image" if data.get("image") else "text"
+    payload = data.get("image") or data.get("text") or ""
+    if kind == "image" and not os.path.isfile(payload):
+        return jsonify({"success": False, "error": "image not found"}), 400
+
+    try:
+        job = bot.broadcaster.create(recipients, kind, payload)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "job": bot.broadcaster.view(job, recipients=False)}), 202
+
+
+@app.route("/broadcast")
+@admin_required
+async def broadcast_list():
+    jobs = [bot.broadcaster.view(job, recipients=False) for job in bot.broadcaster.jobs.values()]
+    return jsonify({"jobs": jobs[::-1], "stats": bot.broadcaster.stats()})
+
+
+@app.route("/broadcast/<job_id>")
+@admin_required
+async def broadcast_status(job_id):
+    job = bot.broadcaster.jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "no such job"}), 404
+    return jsonify({"success": True, "job": bot.broadcaster.view(job)})
+
+
+@app.route("/broadcast/<job_id>/cancel", methods=["POST"])
+@admin_required
+async def broadcast_cancel(job_id):
+    if not bot.broadcaster.cancel(job_id):
+        return jsonify({"success": False, "error": "no running job"}), 404
+    return jsonify({"success": True, "job": bot.broadcaster.view(bot.broadcaster.jobs[job_id])})
+
+
+@app.route("/media")
+@admin_required
+async def media_list():
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be an integer"}), 400
+    captures = await asyncio.to_thread(
+        bot.media_store.captures, request.args.get("chat"), limit
+    )
+    return jsonify({"captures": captures, "stats": bot.media_store.stats()})
+
+
+@app.route("/media/<sha>")
+@admin_required
+async def media_file(sha):
+    found = None
+    if re.fullmatch(r"[0-9a-f]{64}", sha):
+        found = await asyncio.to_thread(bot.media_store.open, sha)
+    if not found:
+        return jsonify({"success": False, "error": "not found"}), 404
+
+    path, mime = found
+    mime = mime or "application/octet-stream"
+    response = await send_file(path, mimetype=mime)
+    extension = mimetypes.guess_extension(mime) or ""
+    response.headers["Content-Disposition"] = f'inline; filename="{sha[:12]}{extension}"'
+    return response
+
+
 @app.route("/restart")
 async def restart():
     global bot
 
+    # Swap in the warm standby browser; ?cold=1 rebuilds everything
+    if request.args.get("cold") != "1" and await bot.supervisor.handover("restart"):
+        return jsonify(
+            {
+                "success": True,
+                "message": "Browser handed over",
+                "handover": bot.supervisor.last_handover,
+            }
+        )
+
     await bot.cleanup()
     bot = ZohaAIBot()
-    await bot.setup_browser()
+    bot.setup_stores()
+    bot.dispatch(bot.start())
     return jsonify({"success": True, "message": "Bot restarted"})
 
 
 # Startup
 @app.before_serving
 async def startup():
-    # Create assets directory if not exists
-    os.makedirs("assets", exist_ok=True)
-    await bot.download_profile_pic()
-    await bot.setup_browser()
-
-    # Try to load session
-    if await bot.load_session():
-        asyncio.create_task(bot.monitor_messages())
-    else:
-        logger.info("⏳ Waiting for pairing...")
+    # Stores first, so routes served while Chrome launches can use them
+    bot.setup_stores()
+    # In the background so the web server answers while Chrome launches
+    bot.dispatch(bot.start())
 
 
 # Shutdown